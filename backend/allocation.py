@@ -0,0 +1,271 @@
+"""Free address lookup within a subnet.
+
+Used addresses are read in numeric order from the `address` index and swept
+as integers, so the cost depends on how many IPs the subnet holds, not on its
+size: a /16 or an IPv6 /64 is no more expensive than a /24 with the same
+number of entries. `network.hosts()` is never enumerated. The network and
+broadcast addresses of subnets nested in the range count as used as well,
+so a parent never hands out a child's reserved addresses.
+
+`allocate_ips` claims free addresses atomically on top of the sweep, relying
+on the unique (subnet_id, address) index rather than on locks.
+
+Child prefixes are carved buddy-allocator style: the parts of a subnet not
+covered by subnets inside it are split into maximal aligned power-of-two
+blocks, kept in free lists per prefix length, and a request takes the first
+aligned block of the wanted size out of the lowest (first fit) or smallest
+(best fit) free block that can hold it.
+"""
+import heapq
+import ipaddress
+import random
+from itertools import islice
+from models import db, Subnet, IPAddress
+from importer import ip_insert, UPDATABLE_COLUMNS
+from hierarchy import subtree_ids
+from radix import subnet_index
+
+SWEEP_BATCH_SIZE = 2000
+MAX_NEXT_FREE = 1024
+MAX_ALLOCATE_ATTEMPTS = 10
+
+
+def host_range(network):
+    """First and last assignable address of `network` as integers, as in `network.hosts()`."""
+    first, last = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4 and network.prefixlen < 31:
+        first, last = first + 1, last - 1  # network and broadcast address
+    elif network.version == 6 and network.prefixlen < 127:
+        first += 1  # subnet-router anycast address
+    return first, last
+
+
+def _address(network, value):
+    return type(network.network_address)(value)
+
+
+def _in_range(network, first, last):
+    return IPAddress.address.between(_address(network, first), _address(network, last))
+
+
+def reserved(version, prefixlen, start, end):
+    """Addresses of a subnet outside its host range (see host_range), as integers."""
+    if version == 4 and prefixlen < 31:
+        return (start, end)
+    if version == 6 and prefixlen < 127:
+        return (start,)
+    return ()
+
+
+def reserved_addresses(network, first, last, snapshot=None):
+    """Sorted network/broadcast addresses of the subnets in `network` between `first` and `last`."""
+    lowest = int(network.network_address)
+    if snapshot is not None:
+        subnets = ((start, end, prefixlen) for _, _, _, prefixlen, start, end, _, _
+                   in snapshot.subnets_starting(network.version, lowest, last))
+    else:
+        subnets = ((int(start), int(end), prefixlen) for start, end, prefixlen in db.session.execute(
+            db.select(Subnet.network_start, Subnet.network_end, Subnet.prefixlen)
+            .where(Subnet.network_start.between(_address(network, lowest), _address(network, last)))))
+    return sorted({address for start, end, prefixlen in subnets
+                   for address in reserved(network.version, prefixlen, start, end)
+                   if first <= address <= last})
+
+
+def _stored_addresses(network, first, last):
+    query = (db.select(IPAddress.address)
+             .where(_in_range(network, first, last))
+             .order_by(IPAddress.address)
+             .execution_options(yield_per=SWEEP_BATCH_SIZE))
+    result = db.session.scalars(query)
+    try:
+        for address in result:
+            yield int(address)
+    finally:
+        result.close()
+
+
+def used_addresses(network, first, last, snapshot=None):
+    """Distinct used addresses between `first` and `last` as ascending integers.
+
+    Stored IPs are read from `snapshot` (see snapshot.py) when given, else
+    from the database; the reserved addresses of nested subnets are added.
+    """
+    if snapshot is not None:
+        stored = snapshot.used_addresses(network.version, first, last)
+    else:
+        stored = _stored_addresses(network, first, last)
+    previous = None
+    for value in heapq.merge(stored, reserved_addresses(network, first, last, snapshot)):
+        if value != previous:
+            yield value
+            previous = value
+
+
+def free_count(network, snapshot=None):
+    first, last = host_range(network)
+    if first > last:
+        return 0
+    if snapshot is not None:
+        return last - first + 1 - sum(1 for _ in used_addresses(network, first, last, snapshot))
+    used = db.session.scalar(db.select(db.func.count(db.distinct(IPAddress.address)))
+                             .where(_in_range(network, first, last)))
+    # Reserved addresses count once, also where an IP row holds one
+    nested = reserved_addresses(network, first, last)
+    taken = set()
+    for start in range(0, len(nested), SWEEP_BATCH_SIZE):
+        chunk = [_address(network, value) for value in nested[start:start + SWEEP_BATCH_SIZE]]
+        taken.update(int(address) for address in db.session.scalars(
+            db.select(IPAddress.address).where(IPAddress.address.in_(chunk))))
+    return last - first + 1 - used - len(set(nested) - taken)
+
+
+def free_ranges(network, snapshot=None):
+    """Yield (start, end) integer pairs of the free ranges of `network`, ascending."""
+    first, last = host_range(network)
+    cursor = first
+    for address in used_addresses(network, first, last, snapshot):
+        if address > cursor:
+            yield cursor, address - 1
+        cursor = address + 1
+    if cursor <= last:
+        yield cursor, last
+
+
+def free_addresses(network, snapshot=None):
+    """Yield the free addresses of `network` as ascending integers."""
+    for start, end in free_ranges(network, snapshot):
+        yield from range(start, end + 1)
+
+
+def next_free(network, count, contiguous=False, snapshot=None):
+    """The lowest `count` free addresses of `network`, or None if there are fewer.
+
+    With `contiguous` the addresses form one consecutive block.
+    """
+    if contiguous:
+        for start, end in free_ranges(network, snapshot):
+            if end - start + 1 >= count:
+                return [_address(network, value) for value in range(start, start + count)]
+        return None
+    found = [_address(network, value) for value in islice(free_addresses(network, snapshot), count)]
+    return found if len(found) == count else None
+
+
+class AllocationConflict(Exception):
+    """Concurrent allocations kept taking the candidate addresses."""
+
+
+def _candidates(network, count, contiguous, attempt):
+    if contiguous or attempt == 0:
+        return next_free(network, count, contiguous)
+    # After a conflict, pick at random from a window of free addresses that
+    # doubles with every attempt, so racing allocators stop colliding on the
+    # lowest address
+    window = max(count, min(count << attempt, MAX_NEXT_FREE))
+    free = [_address(network, value) for value in islice(free_addresses(network), window)]
+    if len(free) < count:
+        return None
+    return sorted(random.sample(free, count))
+
+
+def allocate_ips(subnet, count=1, contiguous=False, values=None):
+    """Insert the lowest free addresses of `subnet`, safely under concurrency.
+
+    Addresses are claimed with `INSERT ... ON CONFLICT DO NOTHING` against the
+    unique (subnet_id, address) index, so two requests can never get the same
+    IP; candidates taken by a concurrent request are simply picked again.
+    Each address goes into the most specific subnet of `subnet`'s subtree.
+    `values` supplies dns_name/architecture/function. Nothing is committed.
+
+    Returns [(id, address, subnet_id)], or None if the subnet does not have
+    enough free addresses. Raises AllocationConflict after
+    MAX_ALLOCATE_ATTEMPTS rounds of losing races.
+    """
+    network = subnet.network
+    scope = set(subtree_ids(subnet))
+    index = subnet_index()
+    values = {c: (values or {}).get(c) or '' for c in UPDATABLE_COLUMNS}
+    table = IPAddress.__table__
+    stmt = (ip_insert(db.session.get_bind().dialect.name)
+            .on_conflict_do_nothing(index_elements=['subnet_id', 'address'])
+            .returning(table.c.id, table.c.address, table.c.subnet_id))
+
+    allocated = []
+    for attempt in range(MAX_ALLOCATE_ATTEMPTS):
+        candidates = _candidates(network, count - len(allocated), contiguous, attempt)
+        if candidates is None:
+            return None
+        rows = [{
+            "subnet_id": next((sid for sid in index.matches(address) if sid in scope), subnet.id),
+            "ip_address": str(address),
+            "address": address,
+            **values,
+        } for address in candidates]
+        inserted = db.session.execute(stmt, rows).all()
+        if contiguous and len(inserted) < len(rows):
+            # A contiguous block is all-or-nothing: delete the part we did claim and
+            # retry. No savepoint: with pysqlite its RELEASE would commit the rows.
+            db.session.execute(db.delete(table).where(table.c.id.in_([row.id for row in inserted])))
+            continue
+        allocated.extend(inserted)
+        if len(allocated) == count:
+            return sorted(allocated, key=lambda row: row.address)
+    raise AllocationConflict(f'Could not allocate {count} address(es) in {subnet.cidr}')
+
+
+def _aligned_blocks(start, end, bits):
+    """Split [start, end] into maximal aligned blocks, as (start, prefixlen) pairs."""
+    while start <= end:
+        size = start & -start if start else 1 << bits
+        while size > end - start + 1:
+            size >>= 1
+        yield start, bits - size.bit_length() + 1
+        start += size
+
+
+def free_blocks(subnet):
+    """Free lists of `subnet`: {prefixlen: [block start, ...]} in ascending order.
+
+    A block is free when no other subnet overlaps it; IPs do not count.
+    """
+    network = subnet.network
+    bits = network.max_prefixlen
+    inner = db.session.execute(
+        db.select(Subnet.network_start, Subnet.network_end)
+        .where(Subnet.id != subnet.id,
+               Subnet.network_start >= subnet.network_start,
+               Subnet.network_end <= subnet.network_end)
+        .order_by(Subnet.network_start)).all()
+
+    blocks = {}
+    cursor, last = int(network.network_address), int(network.broadcast_address)
+    for start, end in inner:
+        if int(start) > cursor:
+            for block, prefixlen in _aligned_blocks(cursor, int(start) - 1, bits):
+                blocks.setdefault(prefixlen, []).append(block)
+        cursor = max(cursor, int(end) + 1)
+    for block, prefixlen in _aligned_blocks(cursor, last, bits):
+        blocks.setdefault(prefixlen, []).append(block)
+    return blocks
+
+
+def find_free_prefix(subnet, prefixlen, best_fit=False):
+    """A free /`prefixlen` network inside `subnet`, or None if there is none.
+
+    First fit returns the lowest free block; best fit splits the smallest
+    free block that is large enough, keeping big blocks intact.
+    Raises ValueError if `prefixlen` does not fit inside `subnet`.
+    """
+    network = subnet.network
+    if not network.prefixlen < prefixlen <= network.max_prefixlen:
+        raise ValueError(f'prefixlen must be between {network.prefixlen + 1} and {network.max_prefixlen}')
+    blocks = free_blocks(subnet)
+    fitting = [length for length in blocks if length <= prefixlen]
+    if not fitting:
+        return None
+    if best_fit:
+        start = blocks[max(fitting)][0]
+    else:
+        start = min(blocks[length][0] for length in fitting)
+    return ipaddress.ip_network((_address(network, start), prefixlen))
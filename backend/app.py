@@ -2,26 +2,31 @@ from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from models import db
+from migrations import upgrade_schema
 from routes import api_bp
+from serialization import FastJSONProvider, compress_response
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///ipam.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'super-secret')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'super-secret')
 
 # Allow all origins for now to prevent issues with local vs prod domains
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"])
 db.init_app(app)
 jwt = JWTManager(app)
 
 app.register_blueprint(api_bp, url_prefix='/api')
+app.after_request(compress_response)
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        upgrade_schema()
     app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true')
@@ -0,0 +1,228 @@
+"""Bulk create, update and delete of IP addresses.
+
+Each operation accepts up to MAX_BULK_ITEMS items. All items are validated and
+resolved up front (subnets through the radix trie, existing rows with a few
+chunked IN queries) and then written with set-based statements, so a request
+costs a handful of round trips instead of one transaction per IP.
+Every item gets its own entry in the result list; a bad item does not fail
+the others.
+"""
+import ipaddress
+from sqlalchemy import bindparam
+from models import db, Subnet, IPAddress
+from importer import ip_insert, UPDATABLE_COLUMNS
+from radix import subnet_index
+
+MAX_BULK_ITEMS = 10000
+# Upper bound on the number of values in one IN (...) lookup
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _error(index, msg):
+    return {"index": index, "status": "error", "msg": msg}
+
+
+def _parse_ip(value):
+    try:
+        return ipaddress.ip_address(str(value).strip())
+    except ValueError:
+        return None
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def bulk_create(items):
+    """Insert new IPs, each into the most specific subnet containing it.
+
+    An item is {ip_address, subnet_id?, dns_name?, architecture?, function?}.
+    With `subnet_id` the IP is placed in the most specific subnet of that
+    subnet's subtree, like `POST /ips`; without it, in the most specific
+    subnet overall. Returns the per-item results.
+    """
+    results = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = _error(i, "Item must be an object")
+            continue
+        ip_obj = _parse_ip(item.get('ip_address'))
+        if ip_obj is None:
+            results[i] = _error(i, f"Invalid IP address: {item.get('ip_address')}")
+            continue
+        scope = None
+        if item.get('subnet_id') is not None:
+            scope = _parse_id(item['subnet_id'])
+            if scope is None:
+                results[i] = _error(i, "Invalid subnet_id")
+                continue
+        pending.append((i, item, ip_obj, scope))
+
+    # Candidate subnets from the trie, then one lookup for the paths and names of all of them
+    index = subnet_index()
+    candidates = {i: index.matches(ip_obj) for i, _, ip_obj, _ in pending}
+    wanted = {sid for ids in candidates.values() for sid in ids}
+    wanted.update(scope for *_, scope in pending if scope is not None)
+    subnets = {}
+    for ids in _chunks(wanted):
+        for row in db.session.execute(db.select(Subnet.id, Subnet.path, Subnet.name).where(Subnet.id.in_(ids))):
+            subnets[row.id] = row
+
+    rows = {}
+    for i, item, ip_obj, scope in pending:
+        if scope is not None and scope not in subnets:
+            results[i] = _error(i, f"Subnet {scope} not found")
+            continue
+        scope_path = subnets[scope].path if scope is not None else ''
+        match = next((sid for sid in candidates[i]
+                      if sid in subnets and subnets[sid].path.startswith(scope_path)), None)
+        if match is None:
+            results[i] = _error(i, f"IP {ip_obj} does not match any subnet in the hierarchy")
+            continue
+        key = (match, ip_obj)
+        if key in rows:
+            results[i] = _error(i, f"Duplicate of item {rows[key][0]}")
+            continue
+        rows[key] = (i, {
+            "subnet_id": match,
+            "ip_address": str(ip_obj),
+            "address": ip_obj,
+            **{c: item.get(c) or '' for c in UPDATABLE_COLUMNS},
+        })
+
+    # One multi-row INSERT; rows that already exist in their subnet come back without an id
+    inserted = {}
+    if rows:
+        table = IPAddress.__table__
+        stmt = (ip_insert(db.session.get_bind().dialect.name)
+                .on_conflict_do_nothing(index_elements=['subnet_id', 'address'])
+                .returning(table.c.id, table.c.subnet_id, table.c.address))
+        for row in db.session.execute(stmt, [params for _, params in rows.values()]):
+            inserted[(row.subnet_id, row.address)] = row.id
+
+    for key, (i, params) in rows.items():
+        subnet = subnets[key[0]]
+        if key in inserted:
+            results[i] = {"index": i, "status": "created", "id": inserted[key],
+                          "ip_address": params['ip_address'], "subnet_id": subnet.id}
+        else:
+            results[i] = _error(i, f"IP address already exists in subnet {subnet.name}")
+    return results
+
+
+def _resolve_targets(items, results):
+    """Map items ({id} or {ip_address, subnet_id?}, or a bare id) to existing IP ids.
+
+    Fills `results` with errors for unresolvable items and returns
+    [(index, item, ip_id, subnet_id)] for the rest.
+    """
+    by_id, by_address = [], []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            item = {"id": item}
+        if item.get('id') is not None:
+            ip_id = _parse_id(item['id'])
+            if ip_id is None:
+                results[i] = _error(i, "Invalid id")
+            else:
+                by_id.append((i, item, ip_id))
+        elif item.get('ip_address') is not None:
+            ip_obj = _parse_ip(item['ip_address'])
+            if ip_obj is None:
+                results[i] = _error(i, f"Invalid IP address: {item['ip_address']}")
+            else:
+                by_address.append((i, item, ip_obj))
+        else:
+            results[i] = _error(i, "Item needs an id or ip_address")
+
+    known_ids = {}
+    for ids in _chunks({ip_id for _, _, ip_id in by_id}):
+        known_ids.update(db.session.execute(
+            db.select(IPAddress.id, IPAddress.subnet_id).where(IPAddress.id.in_(ids))).tuples().all())
+    rows_by_address = {}
+    for addresses in _chunks({ip_obj for _, _, ip_obj in by_address}):
+        stmt = db.select(IPAddress.id, IPAddress.subnet_id, IPAddress.address).where(IPAddress.address.in_(addresses))
+        for row in db.session.execute(stmt):
+            rows_by_address.setdefault(row.address, []).append(row)
+
+    targets = []
+    for i, item, ip_id in by_id:
+        if ip_id in known_ids:
+            targets.append((i, item, ip_id, known_ids[ip_id]))
+        else:
+            results[i] = _error(i, f"IP {ip_id} not found")
+    for i, item, ip_obj in by_address:
+        matches = rows_by_address.get(ip_obj, [])
+        if item.get('subnet_id') is not None:
+            matches = [row for row in matches if row.subnet_id == _parse_id(item['subnet_id'])]
+        if not matches:
+            results[i] = _error(i, f"IP address {ip_obj} not found")
+        elif len(matches) > 1:
+            results[i] = _error(i, f"IP address {ip_obj} exists in several subnets; pass subnet_id or id")
+        else:
+            targets.append((i, item, matches[0].id, matches[0].subnet_id))
+    targets.sort()
+    return targets
+
+
+def bulk_update(items):
+    """Update dns_name/architecture/function of existing IPs.
+
+    Fields missing from an item (or null) are left unchanged. Returns the
+    per-item results.
+    """
+    results = [None] * len(items)
+    params = []
+    for i, item, ip_id, subnet_id in _resolve_targets(items, results):
+        if not isinstance(item, dict) or not any(item.get(c) is not None for c in UPDATABLE_COLUMNS):
+            results[i] = _error(i, "Nothing to update")
+            continue
+        params.append({"target_id": ip_id, **{f'new_{c}': item.get(c) for c in UPDATABLE_COLUMNS}})
+        results[i] = {"index": i, "status": "updated", "id": ip_id, "subnet_id": subnet_id}
+
+    if params:
+        _update_rows(params)
+    return results
+
+
+def _update_rows(params):
+    table = IPAddress.__table__
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # One UPDATE ... FROM (VALUES ...) statement; an executemany would still
+        # be one round trip per row with psycopg2
+        new = (db.values(db.column('target_id', db.Integer),
+                         *(db.column(f'new_{c}', db.String) for c in UPDATABLE_COLUMNS), name='new')
+               .data([(p['target_id'], *(p[f'new_{c}'] for c in UPDATABLE_COLUMNS)) for p in params]))
+        db.session.execute(db.update(table)
+                           .where(table.c.id == new.c.target_id)
+                           .values({c: db.func.coalesce(new.c[f'new_{c}'], table.c[c])
+                                    for c in UPDATABLE_COLUMNS}))
+        return
+    stmt = (db.update(table)
+            .where(table.c.id == bindparam('target_id'))
+            .values({c: db.func.coalesce(bindparam(f'new_{c}', type_=db.String), table.c[c])
+                     for c in UPDATABLE_COLUMNS}))
+    db.session.execute(stmt, params)
+
+
+def bulk_delete(items):
+    """Delete existing IPs. Returns the per-item results."""
+    results = [None] * len(items)
+    ids = set()
+    for i, _, ip_id, subnet_id in _resolve_targets(items, results):
+        ids.add(ip_id)
+        results[i] = {"index": i, "status": "deleted", "id": ip_id, "subnet_id": subnet_id}
+    for chunk in _chunks(ids):
+        db.session.execute(db.delete(IPAddress).where(IPAddress.id.in_(chunk))
+                           .execution_options(synchronize_session=False))
+    return results
@@ -0,0 +1,103 @@
+"""Per-worker read cache for the subnet list.
+
+`subnet_cache` holds a few recently built responses (bounded by
+SUBNET_CACHE_SIZE, each kept for at most SUBNET_CACHE_TTL seconds) keyed on
+the data revision they were built from, so an entry is never served once any
+worker has committed a write. Writes made through this worker's sessions
+also clear the cache as soon as they are committed: the session events below
+note every flush, bulk statement or `revisions.bump()` that touches the
+`subnet` or `ip_address` table and drop all entries after the commit.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Subnet, IPAddress
+
+SUBNET_CACHE_SIZE = int(os.getenv('SUBNET_CACHE_SIZE', '16'))
+SUBNET_CACHE_TTL = float(os.getenv('SUBNET_CACHE_TTL', '60'))
+
+_WATCHED_TABLES = {Subnet.__tablename__, IPAddress.__tablename__}
+
+
+class ReadCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get_or_build(self, key, build):
+        """Return the cached value for `key`, calling `build()` to create it on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Built outside the lock; concurrent misses for one key just build it twice
+        value = build()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+subnet_cache = ReadCache(SUBNET_CACHE_SIZE, SUBNET_CACHE_TTL)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_flushed_changes(session, flush_context):
+    rows = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(row, (Subnet, IPAddress)) for row in rows):
+        session.info['subnet_cache_stale'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_changes(orm_execute_state):
+    # UPDATE/DELETE/INSERT statements run through session.execute() bypass the unit of work
+    if orm_execute_state.is_select:
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and table.name in _WATCHED_TABLES:
+        orm_execute_state.session.info['subnet_cache_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('subnet_cache_stale', False):
+        subnet_cache.clear()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('subnet_cache_stale', None)
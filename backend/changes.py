@@ -0,0 +1,98 @@
+"""Change feed for delta sync.
+
+Every write records the subnets and IPs it touched in the append-only
+`change_log` table, in the same transaction. Rows are written with an empty
+revision and stamped with the write's data revision by `revisions.bump()`
+right before the commit, so the feed uses the same numbering as the ETags
+and a client can ask for everything after the revision it last saw.
+
+Only the last MAX_CHANGES rows are kept: each stamp drops the revisions
+before them, since a client that far behind is sent back to the full lists
+anyway. `changes_between()` refuses a `since` older than the oldest kept
+revision, so pruning never produces an incomplete delta.
+
+`upsert` means "this row may have changed, read its current state". A
+logged row that no longer exists is reported as deleted, which keeps the
+logging of set-based statements simple: log the ids an UPDATE may touch,
+including ones a later DELETE in the same request removes.
+"""
+from models import db, Subnet, IPAddress, ChangeLog
+
+SUBNET = 'subnet'
+IP = 'ip'
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+# Larger deltas are refused; the client reloads the full lists instead
+MAX_CHANGES = 10000
+LOOKUP_CHUNK_SIZE = 1000
+
+_MODELS = {SUBNET: Subnet, IP: IPAddress}
+
+
+def log_changes(entity, ids, action=UPSERT):
+    """Record explicit subnet or IP ids."""
+    rows = [{"entity": entity, "entity_id": entity_id, "action": action}
+            for entity_id in {i for i in ids if i is not None}]
+    if rows:
+        db.session.execute(db.insert(ChangeLog), rows)
+
+
+def log_matching(entity, *criteria, action=UPSERT):
+    """Record every subnet or IP matching `criteria` with one INSERT ... SELECT."""
+    model = _MODELS[entity]
+    db.session.execute(db.insert(ChangeLog).from_select(
+        ['entity', 'entity_id', 'action'],
+        db.select(db.literal(entity), model.id, db.literal(action)).where(*criteria)))
+
+
+def stamp_changes(revision):
+    """Assign `revision` to the change rows written by the current transaction
+    and prune the revisions older than the last MAX_CHANGES rows."""
+    db.session.execute(db.update(ChangeLog)
+                       .where(ChangeLog.revision.is_(None))
+                       .values(revision=revision)
+                       .execution_options(synchronize_session=False))
+    # Whole revisions are removed, so the oldest kept one is complete
+    last_id = db.select(db.func.max(ChangeLog.id)).scalar_subquery()
+    cutoff = db.session.scalar(db.select(ChangeLog.revision)
+                               .where(ChangeLog.id <= last_id - MAX_CHANGES)
+                               .order_by(ChangeLog.id.desc())
+                               .limit(1))
+    if cutoff is not None:
+        db.session.execute(db.delete(ChangeLog)
+                           .where(ChangeLog.revision < cutoff)
+                           .execution_options(synchronize_session=False))
+
+
+def changes_between(since, until):
+    """Compacted changes with since < revision <= until.
+
+    Returns {entity: (upserted rows, deleted ids)} with the current model rows
+    of changed entities, or None if there are more than MAX_CHANGES or rows
+    after `since` have been pruned.
+    """
+    oldest = db.session.scalar(db.select(db.func.min(ChangeLog.revision)))
+    if oldest is not None and since < oldest - 1:
+        return None
+    last = (db.select(db.func.max(ChangeLog.id).label('id'))
+            .where(ChangeLog.revision > since, ChangeLog.revision <= until)
+            .group_by(ChangeLog.entity, ChangeLog.entity_id)
+            .subquery())
+    entries = db.session.execute(
+        db.select(ChangeLog.entity, ChangeLog.entity_id, ChangeLog.action)
+        .join(last, ChangeLog.id == last.c.id)
+        .limit(MAX_CHANGES + 1)).all()
+    if len(entries) > MAX_CHANGES:
+        return None
+
+    result = {}
+    for entity, model in _MODELS.items():
+        ids = [e.entity_id for e in entries if e.entity == entity and e.action == UPSERT]
+        rows = []
+        for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+            rows.extend(model.query.filter(model.id.in_(ids[start:start + LOOKUP_CHUNK_SIZE])))
+        found = {row.id for row in rows}
+        deleted = sorted({e.entity_id for e in entries if e.entity == entity and e.entity_id not in found})
+        result[entity] = (rows, deleted)
+    return result
@@ -17,9 +17,11 @@ wait_for_db
 python -c "
 from app import app, db
 from models import User
+from migrations import upgrade_schema
 
 with app.app_context():
     db.create_all()
+    upgrade_schema()
     if not User.query.filter_by(username='admin').first():
         print('Creating default admin user...')
         admin = User(username='admin')
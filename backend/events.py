@@ -0,0 +1,183 @@
+"""Server-Sent Events push of inventory changes: `GET /api/events`.
+
+Runs as its own small process next to gunicorn (see entrypoint.sh) on
+EVENTS_PORT, so idle streams cost a coroutine each instead of a sync worker:
+
+    python events.py
+
+One poller per process reads the data revision (see revisions.py) every
+EVENTS_POLL_INTERVAL seconds and wakes all connected clients when it has
+moved, so database load does not grow with the number of clients, and
+writes made through any replica are seen. Each event names the new revision
+and a summary of what changed; clients fetch the details from
+`GET /api/changes?since=<previous revision>`. A client that falls behind
+simply receives the latest revision, so slow readers never queue events.
+
+EventSource cannot set headers, so the JWT is accepted as `?token=` as well
+as in the Authorization header. The stream ends when the token expires and
+the client reconnects with a fresh one.
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+import jwt
+from sqlalchemy import select, func
+from app import app
+from models import db, DataRevision, ChangeLog
+from revisions import DATA
+
+EVENTS_PORT = int(os.getenv('EVENTS_PORT', '5001'))
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '1'))
+KEEPALIVE_INTERVAL = 15
+EVENTS_PATH = '/api/events'
+# Changed subnet ids listed in one event at most
+MAX_EVENT_SUBNETS = 100
+
+revision_table = DataRevision.__table__
+change_table = ChangeLog.__table__
+
+
+class RevisionFeed:
+    """Polls the data revision and wakes the waiting streams when it changes."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.revision = None
+        self.summary = {}
+        self._changed = asyncio.Condition()
+
+    def _read(self, since):
+        with self.engine.connect() as conn:
+            revision = conn.execute(select(revision_table.c.value)
+                                    .where(revision_table.c.name == DATA)).scalar() or 0
+            if since is None or revision <= since:
+                return revision, {}
+            window = (change_table.c.revision > since, change_table.c.revision <= revision)
+            counts = dict(conn.execute(select(change_table.c.entity, func.count(func.distinct(change_table.c.entity_id)))
+                                       .where(*window).group_by(change_table.c.entity)).all())
+            subnet_ids = conn.execute(select(change_table.c.entity_id).distinct()
+                                      .where(*window, change_table.c.entity == 'subnet')
+                                      .order_by(change_table.c.entity_id)
+                                      .limit(MAX_EVENT_SUBNETS)).scalars().all()
+            return revision, {"subnets": counts.get('subnet', 0), "ips": counts.get('ip', 0),
+                              "subnet_ids": subnet_ids}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                revision, summary = await loop.run_in_executor(None, self._read, self.revision)
+            except Exception as e:  # database restarting; keep the streams open
+                print(f'events: could not read the data revision: {e}')
+            else:
+                if revision != self.revision:
+                    async with self._changed:
+                        self.revision, self.summary = revision, summary
+                        self._changed.notify_all()
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    async def wait_past(self, revision, timeout):
+        """Wait until the revision differs from `revision`; False on timeout."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.revision != revision), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+def authenticate(token):
+    """Claims of a valid access token, or None."""
+    try:
+        claims = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+    except jwt.PyJWTError:
+        return None
+    return claims if claims.get('type') == 'access' else None
+
+
+def _response(writer, status, body=b'', headers=()):
+    head = [f'HTTP/1.1 {status}', 'Access-Control-Allow-Origin: *', *headers]
+    if body:
+        head += ['Content-Type: application/json', f'Content-Length: {len(body)}', 'Connection: close']
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+
+
+async def _read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    method, _, rest = request_line.partition(' ')
+    return method, rest.rpartition(' ')[0] or rest, headers
+
+
+async def handle(feed, reader, writer):
+    try:
+        method, target, headers = await asyncio.wait_for(_read_request(reader), 10)
+        url = urlsplit(target)
+        if method != 'GET' or url.path not in (EVENTS_PATH, EVENTS_PATH + '/health'):
+            _response(writer, '404 Not Found', b'{"msg": "Not found"}')
+            return
+        if url.path.endswith('/health'):
+            _response(writer, '200 OK', json.dumps({"status": "ok", "revision": feed.revision}).encode())
+            return
+
+        token = parse_qs(url.query).get('token', [''])[0]
+        auth = headers.get('authorization', '')
+        if not token and auth.lower().startswith('bearer '):
+            token = auth[7:]
+        claims = authenticate(token)
+        if claims is None:
+            _response(writer, '401 Unauthorized', b'{"msg": "Missing or invalid token"}')
+            return
+
+        _response(writer, '200 OK', headers=(
+            'Content-Type: text/event-stream', 'Cache-Control: no-cache', 'Connection: keep-alive',
+            'X-Accel-Buffering: no'))  # tell nginx not to buffer the stream
+        writer.write(b'retry: 3000\n\n')
+        await writer.drain()
+
+        # Resume after a reconnect: report anything missed since Last-Event-ID right away
+        last_id = headers.get('last-event-id')
+        seen = int(last_id) if last_id and last_id.isdigit() else feed.revision
+        expires = claims.get('exp', float('inf'))
+        while time.time() < expires:
+            timeout = min(KEEPALIVE_INTERVAL, max(expires - time.time(), 0))
+            if seen != feed.revision or await feed.wait_past(seen, timeout):
+                seen = feed.revision
+                data = json.dumps({"revision": seen, **feed.summary})
+                writer.write(f'id: {seen}\nevent: change\ndata: {data}\n\n'.encode())
+            else:
+                writer.write(b': keepalive\n\n')
+            await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def main():
+    # Same database settings as the API; only the engine is used, outside any request
+    with app.app_context():
+        engine = db.engine
+    feed = RevisionFeed(engine)
+    poller = asyncio.create_task(feed.run())
+    server = await asyncio.start_server(lambda r, w: handle(feed, r, w), '0.0.0.0', EVENTS_PORT)
+    print(f'Serving {EVENTS_PATH} on port {EVENTS_PORT}')
+    async with server:
+        await asyncio.gather(server.serve_forever(), poller)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
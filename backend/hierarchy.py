@@ -0,0 +1,273 @@
+"""Queries over the subnet hierarchy (`Subnet.parent_id`).
+
+Every subnet also stores a materialized path of its ancestor ids, e.g.
+`/1/5/12/` for subnet 12 under 5 under 1. A subtree is then a single indexed
+range scan on `Subnet.path` and the ancestors are read straight from the path.
+The path must be kept in sync on create, re-parent and delete through the
+helpers below.
+"""
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from models import db, Subnet, IPAddress
+
+# Guards the recursion against parent_id cycles in inconsistent data
+MAX_DEPTH = 128
+
+
+def subtree_cte(subnet_id):
+    """Recursive CTE yielding (id, depth) for `subnet_id` and all its descendants."""
+    tree = (db.select(Subnet.id, db.literal(0).label('depth'))
+            .where(Subnet.id == subnet_id)
+            .cte('subtree', recursive=True))
+    return tree.union_all(
+        db.select(Subnet.id, (tree.c.depth + 1).label('depth'))
+        .where(Subnet.parent_id == tree.c.id, tree.c.depth < MAX_DEPTH)
+    )
+
+
+def _path_range(path):
+    # Every descendant path starts with `path`; '0' is the character right after '/'
+    return path, path[:-1] + '0'
+
+
+def in_subtree(subnet):
+    """Filter on `Subnet` matching `subnet` and all its descendants."""
+    lower, upper = _path_range(subnet.path)
+    return db.and_(Subnet.path >= lower, Subnet.path < upper)
+
+
+def path_ids(path):
+    return [int(part) for part in path.strip('/').split('/')] if path else []
+
+
+def subtree(subnet):
+    """(id, depth) rows of the subtree rooted at `subnet`, in one round trip."""
+    if subnet.path is None:
+        tree = subtree_cte(subnet.id)
+        return db.session.execute(
+            db.select(tree.c.id, tree.c.depth).order_by(tree.c.depth, tree.c.id)).all()
+    base = subnet.path.count('/')
+    rows = db.session.execute(db.select(Subnet.id, Subnet.path).where(in_subtree(subnet))).all()
+    return sorted(((row.id, row.path.count('/') - base) for row in rows), key=lambda r: (r[1], r[0]))
+
+
+def subtree_ids(subnet):
+    """Ids of `subnet` and all its descendants."""
+    return [subnet_id for subnet_id, _ in subtree(subnet)]
+
+
+def ip_counts(subnets):
+    """Direct and subtree IP counts per subnet id, from one GROUP BY query.
+
+    Subtree totals are summed along each subnet's path, so `subnets` must hold
+    every subnet whose total is wanted together with all of its descendants.
+    """
+    direct = dict(db.session.query(IPAddress.subnet_id, db.func.count(IPAddress.id))
+                  .group_by(IPAddress.subnet_id))
+    total = dict.fromkeys((s.id for s in subnets), 0)
+    for s in subnets:
+        count = direct.get(s.id, 0)
+        for ancestor_id in path_ids(s.path) or [s.id]:
+            if ancestor_id in total:
+                total[ancestor_id] += count
+    return direct, total
+
+
+class SubnetTree:
+    """Parent/child index over serialized subnets (dicts with id and parent_id).
+
+    Built in one pass, so the cost is the O(n log n) sort of `rows`: children
+    keep the order in which they appear. Rows whose parent is missing count
+    as roots.
+    """
+
+    def __init__(self, rows):
+        self.rows = {row['id']: row for row in rows}
+        self.children = {}
+        for row in rows:
+            parent_id = row['parent_id'] if row['parent_id'] in self.rows else None
+            self.children.setdefault(parent_id, []).append(row['id'])
+
+    def nested(self, parent_id=None, depth=None):
+        """Children of `parent_id` (None: the roots) as nested dicts.
+
+        Each node gets `child_count` and `children`; below `depth` levels
+        `children` is None for nodes that have any, to be loaded separately.
+        """
+        nodes = []
+        for subnet_id in self.children.get(parent_id, []):
+            child_ids = self.children.get(subnet_id, [])
+            node = dict(self.rows[subnet_id], child_count=len(child_ids))
+            if depth is not None and depth <= 1 and child_ids:
+                node['children'] = None
+            else:
+                node['children'] = self.nested(subnet_id, None if depth is None else depth - 1)
+            nodes.append(node)
+        return nodes
+
+
+def assign_path(subnet, parent=None):
+    """Set the path of a flushed (id-bearing) subnet placed under `parent`."""
+    subnet.path = f'{parent.path if parent else "/"}{subnet.id}/'
+
+
+def _replace_path_prefix(old_prefix, new_prefix, exclude_id=None):
+    lower, upper = _path_range(old_prefix)
+    stmt = (db.update(Subnet)
+            .where(Subnet.path >= lower, Subnet.path < upper)
+            .values(path=db.literal(new_prefix) + func.substr(Subnet.path, len(old_prefix) + 1))
+            .execution_options(synchronize_session=False))
+    if exclude_id is not None:
+        stmt = stmt.where(Subnet.id != exclude_id)
+    db.session.execute(stmt)
+
+
+def is_descendant(subnet, candidate):
+    """True if `candidate` is `subnet` or lies in its subtree."""
+    return candidate.path.startswith(subnet.path)
+
+
+def move_subtree(subnet, new_parent):
+    """Re-parent `subnet` and rewrite the paths of its whole subtree in one UPDATE."""
+    old_path = subnet.path
+    new_path = f'{new_parent.path if new_parent else "/"}{subnet.id}/'
+    _replace_path_prefix(old_path, new_path)
+    subnet.parent_id = new_parent.id if new_parent else None
+    db.session.expire(subnet, ['path'])
+
+
+def detach_subnet(subnet):
+    """Promote `subnet`'s children to its parent before the subnet row is deleted."""
+    parent_prefix = subnet.path[:-len(f'{subnet.id}/')]
+    _replace_path_prefix(subnet.path, parent_prefix, exclude_id=subnet.id)
+    db.session.execute(db.update(Subnet)
+                       .where(Subnet.parent_id == subnet.id)
+                       .values(parent_id=subnet.parent_id)
+                       .execution_options(synchronize_session=False))
+
+
+def overlapping_ids(start, end):
+    """Ids of the subnets whose range overlaps start..end (containers and contained)."""
+    return list(db.session.scalars(
+        db.select(Subnet.id).where(Subnet.network_start <= end, Subnet.network_end >= start)))
+
+
+def delete_subtree(subnet):
+    """Delete `subnet`, its descendants and their IPs with two set-based statements.
+
+    The IPs are deleted explicitly rather than through ON DELETE CASCADE so that
+    SQLite databases created before the cascade was added are covered as well.
+    Returns (deleted subnets, deleted IPs).
+    """
+    ids = db.select(Subnet.id).where(in_subtree(subnet))
+    deleted_ips = db.session.execute(
+        db.delete(IPAddress).where(IPAddress.subnet_id.in_(ids))
+        .execution_options(synchronize_session=False)).rowcount
+    deleted_subnets = db.session.execute(
+        db.delete(Subnet).where(in_subtree(subnet))
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.expunge(subnet)
+    return deleted_subnets, deleted_ips
+
+
+def rehome_ips(subnet, recursive=False):
+    """Move the IPs of `subnet` (with `recursive`, of its whole subtree) to its parent.
+
+    One UPDATE, the reverse of `absorb_ips()`. IPs whose address already exists
+    in the parent are left behind to be deleted with the subnet. Returns the
+    number of IPs moved.
+    """
+    source = (IPAddress.subnet_id.in_(db.select(Subnet.id).where(in_subtree(subnet))) if recursive
+              else IPAddress.subnet_id == subnet.id)
+    existing = aliased(IPAddress)
+    in_parent = (db.select(existing.id)
+                 .where(existing.subnet_id == subnet.parent_id, existing.address == IPAddress.address)
+                 .exists())
+    return db.session.execute(
+        db.update(IPAddress)
+        .where(source, ~in_parent)
+        .values(subnet_id=subnet.parent_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def absorb_ips(subnet):
+    """Move the IPs inside `subnet`'s range out of less specific subnets containing it.
+
+    Covers every containing subnet regardless of parent_id (root subnets and
+    sibling mismatches too) with one indexed UPDATE; IPs already in more
+    specific subnets inside the range stay where they are. Returns the count.
+    """
+    containing = db.select(Subnet.id).where(
+        Subnet.id != subnet.id,
+        Subnet.network_start <= subnet.network_start,
+        Subnet.network_end >= subnet.network_end,
+        Subnet.prefixlen < subnet.prefixlen,
+    )
+    return db.session.execute(
+        db.update(IPAddress)
+        .where(IPAddress.address.between(subnet.network_start, subnet.network_end),
+               IPAddress.subnet_id.in_(containing))
+        .values(subnet_id=subnet.id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _outside_range(subnet):
+    return db.and_(IPAddress.subnet_id == subnet.id,
+                   ~IPAddress.address.between(subnet.network_start, subnet.network_end))
+
+
+def release_ips(subnet, old_start, old_end):
+    """Move `subnet`'s IPs that fall outside its changed range to the most specific
+    other subnet containing each one. Returns the count.
+
+    The candidates are the few subnets overlapping the old range but not nested in
+    the new one; going from most to least specific, each gets its share with one
+    indexed range UPDATE, so every IP moves once. IPs that no subnet contains are
+    left behind (see `homeless_ip_count()`).
+    """
+    candidates = db.session.execute(
+        db.select(Subnet.id, Subnet.network_start, Subnet.network_end)
+        .where(Subnet.id != subnet.id,
+               Subnet.network_start <= old_end, Subnet.network_end >= old_start,
+               ~db.and_(Subnet.network_start >= subnet.network_start,
+                        Subnet.network_end <= subnet.network_end))
+        .order_by(Subnet.prefixlen.desc())).all()
+    moved = 0
+    for candidate in candidates:
+        moved += db.session.execute(
+            db.update(IPAddress)
+            .where(_outside_range(subnet),
+                   IPAddress.address.between(candidate.network_start, candidate.network_end))
+            .values(subnet_id=candidate.id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    return moved
+
+
+def homeless_ip_count(subnet):
+    """Number of `subnet`'s IPs outside its range, e.g. left over by `release_ips()`."""
+    return db.session.scalar(db.select(func.count(IPAddress.id)).where(_outside_range(subnet)))
+
+
+def rebuild_paths():
+    """Recompute every subnet's path from parent_id with one recursive query.
+
+    Subnets whose parent_id points at a deleted row are treated as roots.
+    """
+    parent = aliased(Subnet)
+    tree = (db.select(Subnet.id, db.cast('/' + db.cast(Subnet.id, db.String) + '/', db.String).label('path'),
+                      db.literal(0).label('depth'))
+            .where(db.or_(Subnet.parent_id.is_(None),
+                          ~db.select(parent.id).where(parent.id == Subnet.parent_id).exists()))
+            .cte('paths', recursive=True))
+    tree = tree.union_all(
+        db.select(Subnet.id, db.cast(tree.c.path + db.cast(Subnet.id, db.String) + '/', db.String).label('path'),
+                  (tree.c.depth + 1).label('depth'))
+        .where(Subnet.parent_id == tree.c.id, tree.c.depth < MAX_DEPTH)
+    )
+    rows = [{'id': row.id, 'path': row.path} for row in db.session.execute(db.select(tree.c.id, tree.c.path))]
+    if rows:
+        db.session.execute(db.update(Subnet), rows)
+    return len(rows)
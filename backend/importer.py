@@ -0,0 +1,151 @@
+"""Streaming CSV import of IP addresses.
+
+The upload is decoded incrementally and processed in chunks of
+IMPORT_CHUNK_SIZE rows. Each chunk is resolved against the subnet radix trie,
+written with one set-based `INSERT ... ON CONFLICT DO UPDATE` and committed on
+its own, so memory use and transaction size stay bounded however large the
+file is. Rejected rows are written to an error CSV (spooled to disk) instead
+of being collected in memory.
+"""
+import codecs
+import csv
+import ipaddress
+import tempfile
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, IPAddress
+from radix import subnet_index
+from revisions import lock_counters, bump
+from changes import log_matching, IP
+
+IMPORT_CHUNK_SIZE = 1000
+UPDATABLE_COLUMNS = ('dns_name', 'architecture', 'function')
+# Error CSVs larger than this are truncated when stored with the import job
+MAX_ERROR_CSV_BYTES = 5 * 1024 * 1024
+
+
+def ip_insert(dialect_name):
+    """Dialect-specific INSERT into ip_address, supporting ON CONFLICT."""
+    if dialect_name == 'postgresql':
+        return postgresql.insert(IPAddress.__table__)
+    if dialect_name == 'sqlite':
+        return sqlite.insert(IPAddress.__table__)
+    raise RuntimeError(f'Bulk upsert is not supported on {dialect_name}')
+
+
+def upsert_ips(rows, columns=UPDATABLE_COLUMNS):
+    """Insert rows, updating `columns` of rows that already exist in their subnet.
+
+    `rows` are dicts with subnet_id, ip_address, address and the UPDATABLE_COLUMNS.
+    Returns the number of rows that were newly created.
+    """
+    if not rows:
+        return 0
+    existing = set(db.session.execute(
+        db.select(IPAddress.subnet_id, IPAddress.address)
+        .where(IPAddress.address.in_({row['address'] for row in rows}))
+    ).all())
+
+    stmt = ip_insert(db.session.get_bind().dialect.name)
+    if columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['subnet_id', 'address'],
+            set_={column: stmt.excluded[column] for column in columns})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['subnet_id', 'address'])
+    db.session.execute(stmt, rows)
+    return sum(1 for row in rows if (row['subnet_id'], row['address']) not in existing)
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.error_csv = None
+
+
+class ErrorFile:
+    """Lazily created CSV of rejected rows, spooled to disk when it grows."""
+
+    def __init__(self, result):
+        self.result = result
+        self._file = None
+        self._writer = None
+
+    def add(self, line, ip_addr, message):
+        result = self.result
+        result.error_count += 1
+        if self._writer is None:
+            self._file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(['line', 'ip_address', 'error'])
+        self._writer.writerow([line, ip_addr, message])
+
+    def close(self):
+        if self._file:
+            self._file.seek(0)
+            self.result.error_csv = self._file.read(MAX_ERROR_CSV_BYTES)
+            self._file.close()
+
+
+def import_csv(binary_stream, on_chunk=None):
+    """Import IP rows from a binary CSV stream and return an ImportResult.
+
+    `on_chunk(result)` is called for every chunk before it is committed, so
+    progress written to the session lands in the same transaction.
+    """
+    result = ImportResult()
+    errors = ErrorFile(result)
+    reader = csv.DictReader(codecs.iterdecode(binary_stream, 'utf-8-sig'))
+    columns = [c for c in UPDATABLE_COLUMNS if c in (reader.fieldnames or [])]
+    index = subnet_index()
+
+    def write_chunk(chunk):
+        lock_counters()
+        created = upsert_ips(list(chunk.values()), columns)
+        result.created += created
+        result.updated += len(chunk) - created
+        if on_chunk:
+            on_chunk(result)
+        if chunk:
+            log_matching(IP, IPAddress.address.in_({row['address'] for row in chunk.values()}))
+        bump({row['subnet_id'] for row in chunk.values()})
+        db.session.commit()
+
+    chunk = {}
+    try:
+        for row in reader:
+            ip_addr = (row.get('ip_address') or '').strip()
+            if not ip_addr:
+                continue
+            result.rows += 1
+
+            # Basic validation
+            try:
+                ip_obj = ipaddress.ip_address(ip_addr)
+            except ValueError:
+                errors.add(reader.line_num, ip_addr, f"Invalid IP: {ip_addr}")
+                continue
+
+            subnet_id = index.lookup(ip_obj)
+            if subnet_id is None:
+                errors.add(reader.line_num, ip_addr, f"No subnet found for IP: {ip_addr}")
+                continue
+
+            key = (subnet_id, ip_obj)
+            if key in chunk:
+                result.updated += 1  # repeated row: the last occurrence wins
+            chunk[key] = {
+                "subnet_id": subnet_id,
+                "ip_address": str(ip_obj),
+                "address": ip_obj,
+                **{c: row.get(c) if c in columns else '' for c in UPDATABLE_COLUMNS},
+            }
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                write_chunk(chunk)
+                chunk = {}
+        write_chunk(chunk)
+    finally:
+        errors.close()
+    return result
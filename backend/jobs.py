@@ -0,0 +1,109 @@
+"""Background CSV import jobs.
+
+`POST /import/ips` spools the upload to a temporary file and returns a job id
+right away; the import itself runs on a small per-process thread pool, so it
+does not hold a gunicorn worker or hit the ingress timeout. All job state
+(status, counters, error CSV) is stored in the `import_job` table and
+committed together with each imported chunk, so any replica can answer
+`GET /import/jobs/<id>`.
+
+That commit doubles as a heartbeat: a job whose `updated_at` has not moved
+for IMPORT_JOB_TIMEOUT seconds belongs to a process that died (worker
+timeout, redeploy, OOM) and is marked failed by `expire_stale_jobs()`.
+"""
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, ImportJob
+from importer import import_csv
+
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '2'))
+IMPORT_JOB_TIMEOUT = int(os.getenv('IMPORT_JOB_TIMEOUT', '900'))
+
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='ipam-import')
+
+
+def submit_import(file, username):
+    """Persist the upload and queue its import. Returns the new ImportJob."""
+    fd, path = tempfile.mkstemp(prefix='ipam-import-', suffix='.csv')
+    with os.fdopen(fd, 'wb') as spool:
+        file.save(spool)
+
+    job = ImportJob(id=uuid.uuid4().hex, status='queued', filename=file.filename, created_by=username,
+                    updated_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    _executor.submit(_run_import, current_app._get_current_object(), job.id, path)
+    return job
+
+
+def expire_stale_jobs():
+    """Mark queued or running jobs without a heartbeat for IMPORT_JOB_TIMEOUT seconds as failed."""
+    now = datetime.utcnow()
+    expired = ImportJob.query.filter(
+        ImportJob.status.in_(('queued', 'running')),
+        db.func.coalesce(ImportJob.updated_at, ImportJob.created_at) < now - timedelta(seconds=IMPORT_JOB_TIMEOUT),
+    ).update({"status": 'failed', "message": 'Import was interrupted', "finished_at": now},
+             synchronize_session=False)
+    if expired:
+        db.session.commit()
+    return expired
+
+
+def _run_import(app, job_id, path):
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job.status != 'queued':  # waited so long in the queue that it was expired
+            os.remove(path)
+            return
+        try:
+            job.status = 'running'
+            job.started_at = job.updated_at = datetime.utcnow()
+            db.session.commit()
+
+            def progress(result):
+                job.rows_processed = result.rows
+                job.created = result.created
+                job.updated = result.updated
+                job.error_count = result.error_count
+                job.updated_at = datetime.utcnow()
+
+            with open(path, 'rb') as upload:
+                result = import_csv(upload, on_chunk=progress)
+            job.status = 'completed'
+            job.message = 'Import completed'
+            job.error_csv = result.error_csv
+        except UnicodeDecodeError:
+            db.session.rollback()
+            job.status = 'failed'
+            job.message = 'File must be UTF-8 encoded'
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.message = str(e)[:500]
+        finally:
+            job.finished_at = job.updated_at = datetime.utcnow()
+            db.session.commit()
+            os.remove(path)
+
+
+def serialize_job(job):
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0
+    return {
+        "id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "message": job.message,
+        "rows_processed": job.rows_processed,
+        "created": job.created,
+        "updated": job.updated,
+        "error_count": job.error_count,
+        "rows_per_second": round(job.rows_processed / elapsed, 1) if elapsed > 0 else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,135 @@
+"""Lightweight, idempotent schema upgrades for existing databases.
+
+`db.create_all()` only creates missing tables, so columns and indexes added to
+existing tables are applied here. Every step checks the live schema first and
+can safely run on each start (see entrypoint.sh).
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import aliased
+from models import db, Subnet, IPAddress
+from hierarchy import rebuild_paths
+from search import create_search_indexes
+from revisions import ensure_counters
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    for name, ddl in columns:
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+
+def _drop_index(conn, table, name):
+    if name in {i['name'] for i in inspect(conn).get_indexes(table)}:
+        conn.execute(text(f'DROP INDEX {name}'))
+
+
+def _cascade_ip_subnet_fk(conn):
+    """Recreate ip_address.subnet_id's foreign key with ON DELETE CASCADE.
+
+    Only PostgreSQL can alter a foreign key in place. Existing SQLite databases
+    keep the old constraint; the delete routes remove IPs explicitly anyway.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+    for fk in inspect(conn).get_foreign_keys('ip_address'):
+        if fk['referred_table'] != 'subnet' or fk.get('options', {}).get('ondelete', '').upper() == 'CASCADE':
+            continue
+        conn.execute(text(f'ALTER TABLE ip_address DROP CONSTRAINT {fk["name"]}'))
+        conn.execute(text('ALTER TABLE ip_address ADD CONSTRAINT ip_address_subnet_id_fkey '
+                          'FOREIGN KEY (subnet_id) REFERENCES subnet (id) ON DELETE CASCADE'))
+
+
+def _clear_dangling_parents(conn):
+    """Make subnets whose parent no longer exists top-level; returns how many.
+
+    Old SQLite databases ran without foreign key enforcement, so deleting a
+    subnet could leave its children pointing at it. With `PRAGMA foreign_keys`
+    on (see models.py), any later UPDATE of such rows would fail.
+    """
+    parent = aliased(Subnet)
+    exists = db.select(parent.id).where(parent.id == Subnet.parent_id).exists()
+    cleared = conn.execute(db.update(Subnet)
+                           .where(Subnet.parent_id.isnot(None), ~exists)
+                           .values(parent_id=None)).rowcount
+    if cleared:
+        print(f'Moved {cleared} subnet(s) with a missing parent to the top level.')
+    return cleared
+
+
+def _remove_duplicate_ips(conn):
+    """Delete repeated (subnet_id, address) rows, keeping the oldest one."""
+    duplicate = aliased(IPAddress)
+    older = (db.select(duplicate.id)
+             .where(duplicate.subnet_id == IPAddress.subnet_id,
+                    duplicate.address == IPAddress.address,
+                    duplicate.id < IPAddress.id)
+             .exists())
+    removed = conn.execute(db.delete(IPAddress).where(IPAddress.address.isnot(None), older)).rowcount
+    if removed:
+        print(f'Removed {removed} duplicate IP address rows.')
+
+
+def _create_indexes(conn, model):
+    for index in model.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _backfill(model, attribute, column):
+    """Re-assign `attribute` on rows where the derived `column` is still NULL.
+
+    The model validators derive the numeric columns on assignment. Rows are
+    walked by id so values that cannot be parsed are not revisited.
+    """
+    last_id = 0
+    while True:
+        rows = (model.query
+                .filter(column.is_(None), model.id > last_id)
+                .order_by(model.id)
+                .limit(BACKFILL_BATCH_SIZE).all())
+        for row in rows:
+            setattr(row, attribute, getattr(row, attribute))
+        db.session.commit()
+        if len(rows) < BACKFILL_BATCH_SIZE:
+            break
+        last_id = rows[-1].id
+
+
+def upgrade_schema():
+    """Bring an existing database up to the current models. Needs an app context."""
+    dialect = db.engine.dialect
+    binary = db.LargeBinary().compile(dialect=dialect)
+    path = Subnet.__table__.c.path.type.compile(dialect=dialect)
+    with db.engine.begin() as conn:
+        _add_missing_columns(conn, 'subnet', [
+            ('network_start', binary),
+            ('network_end', binary),
+            ('prefixlen', 'INTEGER'),
+            ('path', path),
+            ('revision', 'INTEGER NOT NULL DEFAULT 0'),
+        ])
+        _add_missing_columns(conn, 'ip_address', [
+            ('address', binary),
+        ])
+        if conn.dialect.name == 'postgresql':
+            # Widen the original VARCHAR(20) columns so IPv6 values fit
+            conn.execute(text('ALTER TABLE subnet ALTER COLUMN cidr TYPE VARCHAR(43)'))
+            conn.execute(text('ALTER TABLE ip_address ALTER COLUMN ip_address TYPE VARCHAR(39)'))
+        orphans = _clear_dangling_parents(conn)
+        _cascade_ip_subnet_fk(conn)
+        _create_indexes(conn, Subnet)
+        _drop_index(conn, 'ip_address', 'ix_ip_address_subnet_address')
+        create_search_indexes(conn)
+
+    _backfill(Subnet, 'cidr', Subnet.network_start)
+    _backfill(IPAddress, 'ip_address', IPAddress.address)
+    with db.engine.begin() as conn:
+        if 'uq_ip_address_subnet_address' not in {i['name'] for i in inspect(conn).get_indexes('ip_address')}:
+            _remove_duplicate_ips(conn)
+        _create_indexes(conn, IPAddress)
+        ensure_counters(conn)
+    if orphans or Subnet.query.filter(Subnet.path.is_(None)).first():
+        rebuild_paths()
+        db.session.commit()
@@ -1,8 +1,54 @@
+import ipaddress
+import sqlite3
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys (and ON DELETE CASCADE) unless enabled per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+class IPKey(db.TypeDecorator):
+    """Stores an IPv4/IPv6 address as a fixed-width, numerically ordered key.
+
+    BigInteger cannot hold IPv6 and SQLite's NUMERIC falls back to REAL above
+    2**63, so the value is encoded as one version byte followed by the 128-bit
+    big-endian address. Byte-wise comparison of the key equals numeric
+    comparison (IPv4 sorts before IPv6), which makes `<`, `>` and `BETWEEN`
+    usable as indexed range predicates on both SQLite and PostgreSQL.
+    """
+    impl = db.LargeBinary(17)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            value = ipaddress.ip_address(value)
+        return bytes([value.version]) + int(value).to_bytes(16, 'big')
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        number = int.from_bytes(value[1:], 'big')
+        if value[0] == 4:
+            return ipaddress.IPv4Address(number)
+        return ipaddress.IPv6Address(number)
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -17,16 +63,96 @@ class User(db.Model):
 class Subnet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    cidr = db.Column(db.String(20), unique=True, nullable=False)
+    cidr = db.Column(db.String(43), unique=True, nullable=False)
     description = db.Column(db.String(200))
     parent_id = db.Column(db.Integer, db.ForeignKey('subnet.id'), nullable=True)
+    # Materialized ancestor path, e.g. '/1/5/12/' (see hierarchy.py). The C collation
+    # keeps PostgreSQL's ordering byte-wise so subtree range scans are correct.
+    path = db.Column(db.String(1024).with_variant(postgresql.VARCHAR(1024, collation='C'), 'postgresql'),
+                     index=True)
+    # Numeric range of the network, kept in sync with `cidr` (see set_range)
+    network_start = db.Column(IPKey)
+    network_end = db.Column(IPKey)
+    prefixlen = db.Column(db.Integer)
+    # Data revision of the last write to this subnet or its IPs (see revisions.py)
+    revision = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     subnets = db.relationship('Subnet', backref=db.backref('parent', remote_side=[id]), lazy=True)
-    ips = db.relationship('IPAddress', backref='subnet', lazy=True, cascade="all, delete-orphan")
+    # The database deletes a subnet's IPs (ON DELETE CASCADE); the ORM never loads them for it
+    ips = db.relationship('IPAddress', backref='subnet', lazy=True, cascade="all, delete-orphan",
+                          passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_subnet_range', 'network_start', 'network_end'),
+    )
+
+    @validates('cidr')
+    def set_range(self, key, cidr):
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except (ValueError, TypeError):
+            self.network_start = self.network_end = self.prefixlen = None
+            return cidr
+        self.network_start = network.network_address
+        self.network_end = network.broadcast_address
+        self.prefixlen = network.prefixlen
+        return cidr
+
+    @property
+    def network(self):
+        return ipaddress.ip_network(self.cidr, strict=False)
 
 class IPAddress(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    subnet_id = db.Column(db.Integer, db.ForeignKey('subnet.id'), nullable=False)
-    ip_address = db.Column(db.String(20), nullable=False)
+    subnet_id = db.Column(db.Integer, db.ForeignKey('subnet.id', ondelete='CASCADE'), nullable=False)
+    ip_address = db.Column(db.String(39), nullable=False)
+    # Numeric form of `ip_address`, used for range predicates and ordering
+    address = db.Column(IPKey, index=True)
     dns_name = db.Column(db.String(100))
     architecture = db.Column(db.String(50)) # VM, Bare Metal, etc.
     function = db.Column(db.String(100))
+
+    __table_args__ = (
+        # Conflict target of the bulk upserts; an address exists at most once per subnet
+        db.Index('uq_ip_address_subnet_address', 'subnet_id', 'address', unique=True),
+    )
+
+    @validates('ip_address')
+    def set_address(self, key, ip_address):
+        try:
+            self.address = ipaddress.ip_address(ip_address)
+        except (ValueError, TypeError):
+            self.address = None
+        return ip_address
+
+class ImportJob(db.Model):
+    """A background CSV import (see jobs.py); progress lives here so any replica can report it."""
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    filename = db.Column(db.String(255))
+    created_by = db.Column(db.String(80))
+    message = db.Column(db.String(500))
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    error_csv = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class DataRevision(db.Model):
+    """Named counters advanced by every write (see revisions.py)."""
+    name = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ChangeLog(db.Model):
+    """Append-only record of changed subnets and IPs (see changes.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    # Data revision of the committing write; set by revisions.bump()
+    revision = db.Column(db.BigInteger, index=True)
+    entity = db.Column(db.String(10), nullable=False)  # subnet, ip
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # upsert, delete
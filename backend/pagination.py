@@ -0,0 +1,58 @@
+"""Keyset (cursor) pagination for IP listings ordered by numeric address.
+
+A cursor is the `address,id` of the last row of the previous page. Pages are
+fetched with `WHERE (address, id) > cursor ORDER BY address, id LIMIT n`,
+which stays an index range scan no matter how deep the client pages.
+"""
+import ipaddress
+from models import db, IPAddress
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+
+def parse_limit(value, default=None):
+    """Page size from a query string value; None means unpaginated."""
+    if value is None or value == '':
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(ip):
+    return f'{ip.address},{ip.id}'
+
+
+def decode_cursor(cursor):
+    address, _, ip_id = cursor.rpartition(',')
+    return ipaddress.ip_address(address), int(ip_id)
+
+
+def paginate(query, limit=None, after=None):
+    """Apply keyset ordering to an IPAddress query.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for a malformed `after` cursor.
+    """
+    query = query.order_by(IPAddress.address, IPAddress.id)
+    if after:
+        address, ip_id = decode_cursor(after)
+        query = query.filter(db.or_(
+            IPAddress.address > address,
+            db.and_(IPAddress.address == address, IPAddress.id > ip_id),
+        ))
+    if limit is None:
+        return query.all(), None
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+def page_headers(total, next_cursor):
+    headers = {"X-Total-Count": str(total)}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return headers
@@ -0,0 +1,184 @@
+"""Binary radix (Patricia) trie for longest-prefix matching of IP addresses.
+
+`SubnetIndex` keeps one trie per IP version, keyed on the subnets' network
+prefixes, and answers "which subnets contain this address" in O(prefix length)
+without parsing any CIDR strings. Each worker process holds one index
+(`subnet_index()`), built once from the `subnet` table, updated incrementally
+for the worker's own subnet changes and rebuilt when the subnet revision shows
+that another worker changed the table.
+"""
+import threading
+from models import db, Subnet
+from revisions import current, SUBNETS
+
+
+class _Node:
+    __slots__ = ('prefix', 'length', 'value', 'children')
+
+    def __init__(self, prefix, length, value=None):
+        self.prefix = prefix
+        self.length = length
+        self.value = value
+        self.children = [None, None]
+
+
+class RadixTrie:
+    """Path-compressed binary trie over `bits`-wide integer prefixes.
+
+    Prefixes are (network int, prefix length) pairs with host bits cleared.
+    Nodes without a value are glue nodes created where two prefixes diverge.
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _bit(self, key, position):
+        return (key >> (self.bits - position - 1)) & 1
+
+    def _mask(self, key, length):
+        shift = self.bits - length
+        return (key >> shift) << shift
+
+    def insert(self, prefix, length, value):
+        node = self.root
+        while True:
+            if node.length == length:
+                if node.value is None:
+                    self.size += 1
+                node.value = value
+                return
+            bit = self._bit(prefix, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(prefix, length, value)
+                self.size += 1
+                return
+            common = min(self.bits - (prefix ^ child.prefix).bit_length(), length, child.length)
+            if common == child.length:
+                node = child
+                continue
+            # Split the edge to `child`, either with the new prefix itself or with a glue node
+            if common == length:
+                branch = _Node(prefix, length, value)
+            else:
+                branch = _Node(self._mask(prefix, common), common)
+                branch.children[self._bit(prefix, common)] = _Node(prefix, length, value)
+            branch.children[self._bit(child.prefix, common)] = child
+            node.children[bit] = branch
+            self.size += 1
+            return
+
+    def remove(self, prefix, length):
+        path = []
+        node = self.root
+        while node is not None and node.length < length:
+            bit = self._bit(prefix, node.length)
+            path.append((node, bit))
+            node = node.children[bit]
+        if node is None or node.length != length or node.prefix != prefix or node.value is None:
+            return False
+        node.value = None
+        self.size -= 1
+        if not path:
+            return True
+
+        # Drop the node if it no longer carries anything, then collapse a glue parent
+        parent, bit = path[-1]
+        children = [c for c in node.children if c is not None]
+        if len(children) > 1:
+            return True
+        parent.children[bit] = children[0] if children else None
+        if not children and len(path) > 1 and parent.value is None:
+            remaining = [c for c in parent.children if c is not None]
+            if len(remaining) == 1:
+                grandparent, parent_bit = path[-2]
+                grandparent.children[parent_bit] = remaining[0]
+        return True
+
+    def matches(self, key):
+        """Values of all prefixes containing `key`, most specific first."""
+        found = []
+        node = self.root
+        while node is not None:
+            if (key ^ node.prefix) >> (self.bits - node.length):
+                break
+            if node.value is not None:
+                found.append(node.value)
+            if node.length == self.bits:
+                break
+            node = node.children[self._bit(key, node.length)]
+        found.reverse()
+        return found
+
+    def lookup(self, key):
+        """Value of the longest prefix containing `key`, or None."""
+        found = self.matches(key)
+        return found[0] if found else None
+
+
+class SubnetIndex:
+    """Longest-prefix-match index of subnet ids for IPv4 and IPv6."""
+
+    def __init__(self):
+        self._tries = {4: RadixTrie(32), 6: RadixTrie(128)}
+
+    def __len__(self):
+        return sum(trie.size for trie in self._tries.values())
+
+    def add(self, network_start, prefixlen, subnet_id):
+        self._tries[network_start.version].insert(int(network_start), prefixlen, subnet_id)
+
+    def remove(self, network_start, prefixlen):
+        return self._tries[network_start.version].remove(int(network_start), prefixlen)
+
+    def matches(self, address):
+        """Ids of all subnets containing `address`, most specific first."""
+        return self._tries[address.version].matches(int(address))
+
+    def lookup(self, address):
+        """Id of the most specific subnet containing `address`, or None."""
+        return self._tries[address.version].lookup(int(address))
+
+
+_lock = threading.Lock()
+_index = None
+# Subnet revision (see revisions.py) the index was built from
+_revision = None
+
+
+def subnet_index():
+    """Return this process's SubnetIndex, rebuilding it if the subnet table changed."""
+    global _index, _revision
+    revision = current(SUBNETS)
+    with _lock:
+        if _index is None or revision != _revision:
+            index = SubnetIndex()
+            rows = (db.session.query(Subnet.id, Subnet.network_start, Subnet.prefixlen)
+                    .filter(Subnet.network_start.isnot(None)))
+            for subnet_id, network_start, prefixlen in rows:
+                index.add(network_start, prefixlen, subnet_id)
+            _index, _revision = index, revision
+        return _index
+
+
+def subnets_changed(revision, removed=(), added=()):
+    """Apply this worker's own committed subnet changes to the local index.
+
+    `revision` is the subnet revision the change was committed with (see
+    `revisions.bump()`), `removed` holds (network_start, prefixlen) pairs and
+    `added` Subnet rows. If another worker committed a change in between, the
+    index is left to be rebuilt on next use.
+    """
+    global _revision
+    with _lock:
+        if _index is None or _revision != revision - 1:
+            return
+        for network_start, prefixlen in removed:
+            if network_start is not None:
+                _index.remove(network_start, prefixlen)
+        for subnet in added:
+            if subnet.network_start is not None:
+                _index.add(subnet.network_start, subnet.prefixlen, subnet.id)
+        _revision = revision
@@ -0,0 +1,102 @@
+"""Revision counters for conditional GETs and cache invalidation.
+
+The `data_revision` table holds two counters: `data`, advanced by every write,
+and `subnets`, advanced only by writes that add, remove or resize subnets
+(what the radix trie in radix.py is built from). Each
+write also stamps the subnets it touched with the new data revision
+(`Subnet.revision`), so the highest revision within a subtree changes
+whenever anything in that subtree does.
+
+Writers call `bump()` right before committing. The counters are ordinary rows
+updated in the same transaction, so a new revision becomes visible together
+with the data it describes and readers never pair old data with a new ETag.
+
+Because every write ends up locking the `data` counter row, writers take that
+lock first with `lock_counters()`, at the start of their transaction (data
+routes do this through the `writes_data` decorator, the importer per chunk).
+Otherwise a writer that
+locked subnet or IP rows before reaching `bump()` and one that already holds
+the counter and then stamps the same subnets would deadlock on PostgreSQL.
+"""
+import functools
+from flask import request
+from models import db, Subnet, DataRevision
+from hierarchy import in_subtree
+from changes import stamp_changes
+from serialization import representation_tag
+
+DATA = 'data'
+SUBNETS = 'subnets'
+
+
+def ensure_counters(conn):
+    """Create the counter rows if they are missing."""
+    existing = set(conn.execute(db.select(DataRevision.name)).scalars())
+    for name in (DATA, SUBNETS):
+        if name not in existing:
+            conn.execute(db.insert(DataRevision).values(name=name, value=0))
+
+
+def current(name=DATA):
+    return db.session.scalar(db.select(DataRevision.value).where(DataRevision.name == name)) or 0
+
+
+def lock_counters():
+    """Lock the data counter row until the end of the current transaction."""
+    db.session.execute(db.select(DataRevision.value)
+                       .where(DataRevision.name == DATA)
+                       .with_for_update())
+
+
+def writes_data(view):
+    """Decorator taking the counter lock before a data-writing view runs.
+
+    Goes below `@jwt_required()`, so unauthenticated requests never wait for
+    the lock.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        lock_counters()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def bump(subnet_ids=(), structure=False):
+    """Advance the data revision (and with `structure`, the subnet revision) and
+    stamp `subnet_ids` and the transaction's change log rows with it.
+    Returns {counter name: new value}.
+    """
+    names = [DATA, SUBNETS] if structure else [DATA]
+    revisions = dict(db.session.execute(
+        db.update(DataRevision)
+        .where(DataRevision.name.in_(names))
+        .values(value=DataRevision.value + 1)
+        .returning(DataRevision.name, DataRevision.value)
+        .execution_options(synchronize_session=False)).all())
+    subnet_ids = {subnet_id for subnet_id in subnet_ids if subnet_id is not None}
+    if subnet_ids:
+        db.session.execute(db.update(Subnet)
+                           .where(Subnet.id.in_(subnet_ids))
+                           .values(revision=revisions[DATA])
+                           .execution_options(synchronize_session=False))
+    stamp_changes(revisions[DATA])
+    return revisions
+
+
+def subtree_revision(subnet):
+    """Highest revision of `subnet` and its descendants, from the subnet table only."""
+    return db.session.scalar(db.select(db.func.max(Subnet.revision)).where(in_subtree(subnet))) or 0
+
+
+def not_modified(tag):
+    """True if the request's If-None-Match already names `tag`.
+
+    Compared weakly: compressed responses carry the tag as a weak ETag.
+    MessagePack requests compare against their own variant of the tag.
+    """
+    return request.if_none_match.contains_weak(representation_tag(tag))
+
+
+def etag_headers(tag):
+    # `no-cache` lets browsers keep the response but revalidate it on every use
+    return {"ETag": f'"{representation_tag(tag)}"', "Cache-Control": "private, no-cache"}
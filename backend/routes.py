@@ -1,7 +1,22 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from models import db, User, Subnet, IPAddress
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Subnet, IPAddress, ImportJob
+from radix import subnet_index, subnets_changed
+from revisions import lock_counters, writes_data, bump, current, subtree_revision, not_modified, etag_headers
+from cache import subnet_cache
+from snapshot import fresh_snapshot, snapshot_stats
+from changes import log_changes, log_matching, changes_between, SUBNET, IP, UPSERT, DELETE
+from pagination import parse_limit, paginate, page_headers, DEFAULT_PAGE_SIZE
+from search import search_query
+from allocation import (free_ranges, free_count, next_free, allocate_ips, find_free_prefix,
+                        AllocationConflict, MAX_NEXT_FREE, MAX_ALLOCATE_ATTEMPTS)
+from bulk import bulk_create, bulk_update, bulk_delete, MAX_BULK_ITEMS
+from hierarchy import (subtree_ids, in_subtree, path_ids, ip_counts, assign_path, is_descendant,
+                       move_subtree, detach_subnet, delete_subtree, rehome_ips, absorb_ips,
+                       release_ips, homeless_ip_count, overlapping_ids, SubnetTree)
 import ipaddress
+import time
 
 api_bp = Blueprint('api', __name__)
 
@@ -70,13 +85,46 @@ def me():
 @api_bp.route('/subnets', methods=['GET'])
 @jwt_required()
 def get_subnets():
-    subnets = Subnet.query.all()
-    # Sort subnets by CIDR (network address)
+    revision = current()
+    tag = str(revision)
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    result = subnet_cache.get_or_build(('subnets', revision), _subnet_list)
+    return jsonify(result), 200, etag_headers(tag)
+
+@api_bp.route('/subnets/tree', methods=['GET'])
+@jwt_required()
+def get_subnet_tree():
     try:
-        subnets.sort(key=lambda s: ipaddress.ip_network(s.cidr))
+        root = int(request.args['root']) if request.args.get('root') else None
+        depth = int(request.args['depth']) if request.args.get('depth') else None
     except ValueError:
-        pass # Handle potential invalid CIDRs gracefully, though they should be validated on creation
-        
+        return jsonify({"msg": "root and depth must be integers"}), 400
+    if depth is not None and depth < 1:
+        return jsonify({"msg": "depth must be at least 1"}), 400
+
+    revision = current()
+    tag = str(revision)
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    tree = subnet_cache.get_or_build(
+        ('tree', revision),
+        lambda: SubnetTree(subnet_cache.get_or_build(('subnets', revision), _subnet_list)))
+    if root is not None and root not in tree.rows:
+        return jsonify({"msg": "Subnet not found"}), 404
+    return jsonify(tree.nested(root, depth)), 200, etag_headers(tag)
+
+@api_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    # Counters of this worker process only
+    return jsonify({"subnets": subnet_cache.stats(), "snapshot": snapshot_stats()}), 200
+
+def _subnet_list():
+    # Sorted by network address, then by prefix length (containers first)
+    subnets = Subnet.query.order_by(Subnet.network_start, Subnet.prefixlen).all()
+    direct_counts, total_counts = ip_counts(subnets)
+
     result = []
     for s in subnets:
         result.append({
@@ -85,12 +133,43 @@ def get_subnets():
             "cidr": s.cidr,
             "description": s.description,
             "parent_id": s.parent_id,
-            "ip_count": len(s.ips)
+            "path": s.path,
+            "ip_count": direct_counts.get(s.id, 0),
+            "total_ip_count": total_counts.get(s.id, 0)
         })
-    return jsonify(result), 200
+    return result
+
+def _insert_subnet(network, name, description, parent):
+    """Add a subnet under `parent` and move the IPs it now covers into it (not committed).
+
+    Returns (subnet, number of reassigned IPs, milliseconds the reassignment took).
+    """
+    new_subnet = Subnet(
+        name=name,
+        cidr=str(network),
+        description=description,
+        parent_id=parent.id if parent else None
+    )
+    db.session.add(new_subnet)
+    db.session.flush()  # Get the ID without committing yet
+    assign_path(new_subnet, parent)
+    
+    started = time.perf_counter()
+    reassigned_count = absorb_ips(new_subnet)
+    reassign_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    log_changes(SUBNET, [new_subnet.id])
+    if reassigned_count:
+        log_matching(IP, IPAddress.subnet_id == new_subnet.id)
+    return new_subnet, reassigned_count, reassign_ms
+
+def _bump_for_new_subnet(subnet):
+    # The new subnet and every subnet it may have taken IPs from
+    return bump(overlapping_ids(subnet.network_start, subnet.network_end), structure=True)
 
 @api_bp.route('/subnets', methods=['POST'])
 @jwt_required()
+@writes_data
 def create_subnet():
     data = request.get_json()
     try:
@@ -98,116 +177,389 @@ def create_subnet():
         new_network = ipaddress.ip_network(data['cidr'], strict=False)
     except ValueError:
         return jsonify({"msg": "Invalid CIDR format"}), 400
-        
-    if Subnet.query.filter_by(cidr=data['cidr']).first():
+
+    if Subnet.query.filter_by(network_start=new_network.network_address,
+                              prefixlen=new_network.prefixlen).first():
         return jsonify({"msg": "Subnet with this CIDR already exists"}), 400
 
-    new_subnet = Subnet(
-        name=data['name'],
-        cidr=data['cidr'],
-        description=data.get('description', ''),
-        parent_id=data.get('parent_id')
-    )
-    db.session.add(new_subnet)
-    db.session.flush()  # Get the ID without committing yet
-    
-    # Reassign IPs: find all existing subnets that contain the new subnet's CIDR
-    # (regardless of parent_id — catches root subnets and sibling mismatches too)
-    reassigned_count = 0
-    all_existing = Subnet.query.filter(Subnet.id != new_subnet.id).all()
-    subnet_map = {s.id: s for s in all_existing}
-
-    containing_ids = []
-    for s in all_existing:
-        try:
-            if new_network.subnet_of(ipaddress.ip_network(s.cidr)):
-                containing_ids.append(s.id)
-        except (ValueError, TypeError):
-            continue
+    parent = None
+    if data.get('parent_id') is not None:
+        parent = db.session.get(Subnet, data['parent_id'])
+        if not parent:
+            return jsonify({"msg": "Parent subnet not found"}), 400
 
-    if containing_ids:
-        candidate_ips = IPAddress.query.filter(IPAddress.subnet_id.in_(containing_ids)).all()
-        for ip in candidate_ips:
-            try:
-                ip_obj = ipaddress.ip_address(ip.ip_address)
-                if ip_obj in new_network:
-                    current_net = ipaddress.ip_network(subnet_map[ip.subnet_id].cidr)
-                    if new_network.prefixlen > current_net.prefixlen:
-                        ip.subnet_id = new_subnet.id
-                        reassigned_count += 1
-            except (ValueError, KeyError):
-                continue
-    
+    new_subnet, reassigned_count, reassign_ms = _insert_subnet(
+        new_network, data['name'], data.get('description', ''), parent)
+    revisions = _bump_for_new_subnet(new_subnet)
     db.session.commit()
-    
+    subnets_changed(revisions['subnets'], added=[new_subnet])
+
     return jsonify({
         "msg": "Subnet created", 
         "id": new_subnet.id,
-        "reassigned_ips": reassigned_count
+        "reassigned_ips": reassigned_count,
+        "reassign_ms": reassign_ms
     }), 201
 
+def _placement_error(subnet, network, parent):
+    """Why `subnet` cannot take the range `network` under `parent`, or None."""
+    if parent is not None:
+        try:
+            inside = network != parent.network and network.subnet_of(parent.network)
+        except TypeError:  # IPv4 vs. IPv6
+            inside = False
+        if not inside:
+            return f"{network} does not lie within the parent subnet {parent.name} ({parent.cidr})"
+    if network == subnet.network:
+        return None
+
+    start, end = network.network_address, network.broadcast_address
+    others = Subnet.query.filter(Subnet.id != subnet.id)
+    if others.filter_by(network_start=start, prefixlen=network.prefixlen).first():
+        return "Subnet with this CIDR already exists"
+    child = others.filter(in_subtree(subnet),
+                          db.or_(Subnet.network_start < start, Subnet.network_end > end)).first()
+    if child:
+        return f"Child subnet {child.name} ({child.cidr}) would lie outside {network}"
+    # CIDR blocks either nest or are disjoint: anything else inside the new range overlaps it
+    overlap = others.filter(~in_subtree(subnet),
+                            Subnet.network_start >= start, Subnet.network_end <= end).first()
+    if overlap:
+        return f"{network} overlaps subnet {overlap.name} ({overlap.cidr})"
+    if parent is not None:
+        enclosing = others.filter(~in_subtree(subnet), Subnet.prefixlen > parent.prefixlen,
+                                  Subnet.network_start <= start, Subnet.network_end >= end).first()
+        if enclosing:
+            return f"{network} lies within subnet {enclosing.name} ({enclosing.cidr}); make it the parent"
+    return None
+
 @api_bp.route('/subnets/<int:id>', methods=['PUT'])
 @jwt_required()
+@writes_data
 def update_subnet(id):
     subnet = Subnet.query.get_or_404(id)
     data = request.get_json()
     
     subnet.name = data.get('name', subnet.name)
     subnet.description = data.get('description', subnet.description)
-    # CIDR update is risky without validation of existing IPs, skipping for now or handle carefully
-    
-    db.session.commit()
-    return jsonify({"msg": "Subnet updated"}), 200
+
+    network = subnet.network
+    if data.get('cidr'):
+        try:
+            network = ipaddress.ip_network(data['cidr'], strict=False)
+        except ValueError:
+            return jsonify({"msg": "Invalid CIDR format"}), 400
+    cidr_changed = network != subnet.network
+
+    parent = subnet.parent
+    parent_changed = 'parent_id' in data and data['parent_id'] != subnet.parent_id
+    if parent_changed:
+        parent = None
+        if data['parent_id'] is not None:
+            parent = db.session.get(Subnet, data['parent_id'])
+            if not parent:
+                return jsonify({"msg": "Parent subnet not found"}), 400
+            if is_descendant(subnet, parent):
+                return jsonify({"msg": "A subnet cannot be moved below itself or its children"}), 400
+
+    if cidr_changed or parent_changed:
+        error = _placement_error(subnet, network, parent)
+        if error:
+            return jsonify({"msg": error}), 400
+    # The re-homing UPDATEs and the CIDR flush raise IntegrityError as they run, not only on commit
+    try:
+        touched = {subnet.id, subnet.parent_id}
+        log_changes(SUBNET, [subnet.id])
+        if parent_changed:
+            touched.add(parent.id if parent else None)
+            move_subtree(subnet, parent)
+            log_matching(SUBNET, in_subtree(subnet))  # their paths changed
+
+        # Re-home IPs for the new range: those now outside go to the most specific other
+        # subnet containing them, those now inside move in from less specific subnets
+        released_count = absorbed_count = 0
+        rehome_ms = 0
+        if cidr_changed:
+            old_start, old_end, old_prefixlen = subnet.network_start, subnet.network_end, subnet.prefixlen
+            touched.update(overlapping_ids(old_start, old_end))
+            subnet.cidr = str(network)
+            db.session.flush()
+            touched.update(overlapping_ids(subnet.network_start, subnet.network_end))
+            started = time.perf_counter()
+            released_count = release_ips(subnet, old_start, old_end)
+            homeless = homeless_ip_count(subnet)
+            if homeless:
+                db.session.rollback()
+                return jsonify({"msg": f"{homeless} IP address(es) would lie outside every subnet"}), 409
+            absorbed_count = absorb_ips(subnet)
+            rehome_ms = round((time.perf_counter() - started) * 1000, 2)
+            if released_count or absorbed_count:
+                log_matching(IP, db.or_(IPAddress.address.between(old_start, old_end),
+                                        IPAddress.address.between(subnet.network_start, subnet.network_end)))
+
+        revisions = bump(touched, structure=cidr_changed)
+        db.session.commit()
+    except IntegrityError:
+        # e.g. a re-homed IP that already exists in its new subnet
+        db.session.rollback()
+        return jsonify({"msg": "Subnet update conflicts with existing subnets or IP addresses"}), 409
+    if cidr_changed:
+        subnets_changed(revisions['subnets'], removed=[(old_start, old_prefixlen)], added=[subnet])
+    return jsonify({
+        "msg": "Subnet updated",
+        "released_ips": released_count,
+        "absorbed_ips": absorbed_count,
+        "rehome_ms": rehome_ms
+    }), 200
 
 @api_bp.route('/subnets/<int:id>', methods=['DELETE'])
 @jwt_required()
+@writes_data
 def delete_subnet(id):
     subnet = Subnet.query.get_or_404(id)
-    db.session.delete(subnet)
+    recursive = request.args.get('recursive', '').lower() in ('1', 'true', 'yes')
+    rehome = request.args.get('rehome', '').lower() in ('1', 'true', 'yes')
+    rehomed_ips = 0
+    # The subnet and its IPs will be gone (reported as deleted), children and
+    # rehomed IPs changed; either way the current state tells
+    log_matching(SUBNET, in_subtree(subnet))
+    log_matching(IP, IPAddress.subnet_id.in_(db.select(Subnet.id).where(in_subtree(subnet))) if recursive
+             else IPAddress.subnet_id == subnet.id)
+    if rehome:
+        # Keep the addresses: they still lie inside the parent, like IPs moved by create_subnet
+        if subnet.parent_id is None:
+            return jsonify({"msg": "A top-level subnet has no parent to move its IPs to"}), 400
+        try:
+            rehomed_ips = rehome_ips(subnet, recursive)
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"msg": "The subtree holds the same IP address more than once"}), 409
+    if recursive:
+        removed = db.session.execute(db.select(Subnet.network_start, Subnet.prefixlen)
+                                     .where(in_subtree(subnet))).all()
+    else:
+        removed = [(subnet.network_start, subnet.prefixlen)]
+        detach_subnet(subnet)
+    parent_id = subnet.parent_id
+    deleted_subnets, deleted_ips = delete_subtree(subnet)
+    revisions = bump([parent_id], structure=True)
     db.session.commit()
-    return jsonify({"msg": "Subnet deleted"}), 200
+    subnets_changed(revisions['subnets'], removed=removed)
+    return jsonify({
+        "msg": "Subnet deleted",
+        "deleted_subnets": deleted_subnets,
+        "deleted_ips": deleted_ips,
+        "rehomed_ips": rehomed_ips
+    }), 200
+
+@api_bp.route('/subnets/<int:id>/path', methods=['GET'])
+@jwt_required()
+def get_subnet_path(id):
+    tag = str(current())
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    subnet = Subnet.query.get_or_404(id)
+    ids = path_ids(subnet.path)
+    ancestors = {s.id: s for s in Subnet.query.filter(Subnet.id.in_(ids))}
+    return jsonify([
+        {"id": s.id, "name": s.name, "cidr": s.cidr}
+        for s in (ancestors.get(i) for i in ids) if s
+    ]), 200, etag_headers(tag)
+
+@api_bp.route('/subnets/<int:id>/free', methods=['GET'])
+@jwt_required()
+def get_free_ranges(id):
+    tag = str(current())
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    subnet = Subnet.query.get_or_404(id)
+    try:
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"msg": "Invalid limit"}), 400
+
+    network = subnet.network
+    address = type(network.network_address)
+    snapshot = fresh_snapshot()
+    ranges = []
+    for start, end in free_ranges(network, snapshot):
+        ranges.append({"start": str(address(start)), "end": str(address(end)), "size": end - start + 1})
+        if len(ranges) > limit:
+            break
+    return jsonify({
+        "subnet_id": subnet.id,
+        "cidr": subnet.cidr,
+        "free": free_count(network, snapshot),
+        "ranges": ranges[:limit],
+        "truncated": len(ranges) > limit,
+    }), 200, etag_headers(tag)
+
+@api_bp.route('/subnets/<int:id>/next-free', methods=['GET'])
+@jwt_required()
+def get_next_free(id):
+    tag = str(current())
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    subnet = Subnet.query.get_or_404(id)
+    try:
+        count = int(request.args.get('count', 1))
+    except ValueError:
+        return jsonify({"msg": "Invalid count"}), 400
+    if not 1 <= count <= MAX_NEXT_FREE:
+        return jsonify({"msg": f"count must be between 1 and {MAX_NEXT_FREE}"}), 400
+    contiguous = request.args.get('contiguous', '').lower() in ('1', 'true', 'yes')
+
+    addresses = next_free(subnet.network, count, contiguous, fresh_snapshot())
+    if addresses is None:
+        return jsonify({"msg": f"Not enough free addresses in {subnet.cidr}"}), 409
+    return jsonify({
+        "subnet_id": subnet.id,
+        "cidr": subnet.cidr,
+        "addresses": [str(a) for a in addresses],
+    }), 200, etag_headers(tag)
+
+@api_bp.route('/subnets/<int:id>/allocate', methods=['POST'])
+@jwt_required()
+@writes_data
+def allocate_subnet_ips(id):
+    subnet = Subnet.query.get_or_404(id)
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Invalid count"}), 400
+    if not 1 <= count <= MAX_NEXT_FREE:
+        return jsonify({"msg": f"count must be between 1 and {MAX_NEXT_FREE}"}), 400
+
+    try:
+        allocated = allocate_ips(subnet, count, bool(data.get('contiguous')), data)
+    except AllocationConflict as e:
+        db.session.rollback()
+        return jsonify({"msg": str(e)}), 503, {"Retry-After": "1"}
+    if allocated is None:
+        db.session.rollback()
+        return jsonify({"msg": f"Not enough free addresses in {subnet.cidr}"}), 409
+    log_changes(IP, [row.id for row in allocated])
+    bump({row.subnet_id for row in allocated})
+    db.session.commit()
+    return jsonify({
+        "msg": "IPs allocated",
+        "ips": [{"id": row.id, "ip_address": str(row.address), "subnet_id": row.subnet_id} for row in allocated],
+    }), 201
+
+@api_bp.route('/subnets/<int:id>/allocate-subnet', methods=['POST'])
+@jwt_required()
+@writes_data
+def allocate_child_subnet(id):
+    data = request.get_json(silent=True) or {}
+    try:
+        prefixlen = int(request.args.get('prefixlen', data.get('prefixlen')))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Invalid prefixlen"}), 400
+    strategy = request.args.get('strategy', data.get('strategy', 'first'))
+    if strategy not in ('first', 'best'):
+        return jsonify({"msg": "strategy must be 'first' or 'best'"}), 400
+
+    # Concurrent requests may pick the same block; the unique CIDR decides and the loser retries
+    for _ in range(MAX_ALLOCATE_ATTEMPTS):
+        parent = Subnet.query.get_or_404(id)
+        try:
+            network = find_free_prefix(parent, prefixlen, best_fit=strategy == 'best')
+        except ValueError as e:
+            return jsonify({"msg": str(e)}), 400
+        if network is None:
+            return jsonify({"msg": f"No free /{prefixlen} left in {parent.cidr}"}), 409
+
+        try:
+            # The flush in _insert_subnet is where a lost race on the CIDR fails
+            new_subnet, reassigned_count, reassign_ms = _insert_subnet(
+                network, data.get('name') or str(network), data.get('description', ''), parent)
+            revisions = _bump_for_new_subnet(new_subnet)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            lock_counters()  # the rollback released it; the next attempt writes again
+            continue
+        subnets_changed(revisions['subnets'], added=[new_subnet])
+        return jsonify({
+            "msg": "Subnet created",
+            "id": new_subnet.id,
+            "cidr": new_subnet.cidr,
+            "reassigned_ips": reassigned_count,
+            "reassign_ms": reassign_ms
+        }), 201
+    return jsonify({"msg": f"Could not allocate a /{prefixlen} in {parent.cidr}"}), 503, {"Retry-After": "1"}
 
 # --- IP Addresses ---
+def serialize_ip(ip, subnet):
+    return {
+        "id": ip.id,
+        "ip_address": ip.ip_address,
+        "dns_name": ip.dns_name,
+        "architecture": ip.architecture,
+        "function": ip.function,
+        "subnet_id": ip.subnet_id,
+        "subnet_name": subnet.name if subnet else "",
+        "subnet_cidr": subnet.cidr if subnet else ""
+    }
+
 @api_bp.route('/subnets/<int:subnet_id>/ips', methods=['GET'])
 @jwt_required()
 def get_ips(subnet_id):
     subnet = Subnet.query.get_or_404(subnet_id)
-    
-    # Get all child subnet IDs recursively
-    def get_all_child_ids(parent_id):
-        children = Subnet.query.filter_by(parent_id=parent_id).all()
-        child_ids = [parent_id]
-        for child in children:
-            child_ids.extend(get_all_child_ids(child.id))
-        return child_ids
-    
-    # Get IPs from this subnet and all child subnets, sorted numerically
-    all_subnet_ids = get_all_child_ids(subnet_id)
-    ips = IPAddress.query.filter(IPAddress.subnet_id.in_(all_subnet_ids)).all()
+    # Changes only when this subnet or one below it is written to
+    tag = f'{subnet_id}-{subtree_revision(subnet)}'
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
     try:
-        ips.sort(key=lambda ip: ipaddress.ip_address(ip.ip_address))
+        limit = parse_limit(request.args.get('limit'))
     except ValueError:
-        pass
+        return jsonify({"msg": "Invalid limit"}), 400
+
+    # Get IPs from this subnet and all child subnets, sorted numerically in SQL.
+    # Without `limit` the whole list is returned, as before.
+    query = IPAddress.query.join(Subnet, IPAddress.subnet_id == Subnet.id).filter(in_subtree(subnet))
+    total = query.with_entities(db.func.count(IPAddress.id)).scalar()
+    try:
+        ips, next_cursor = paginate(query, limit, request.args.get('after'))
+    except ValueError:
+        return jsonify({"msg": "Invalid cursor"}), 400
 
     # Build subnet lookup to avoid N+1 queries
-    subnet_lookup = {s.id: s for s in Subnet.query.filter(Subnet.id.in_(all_subnet_ids)).all()}
+    page_subnet_ids = {ip.subnet_id for ip in ips}
+    subnet_lookup = {s.id: s for s in Subnet.query.filter(Subnet.id.in_(page_subnet_ids)).all()}
 
-    result = []
-    for ip in ips:
-        ip_subnet = subnet_lookup.get(ip.subnet_id)
-        result.append({
-            "id": ip.id,
-            "ip_address": ip.ip_address,
-            "dns_name": ip.dns_name,
-            "architecture": ip.architecture,
-            "function": ip.function,
-            "subnet_name": ip_subnet.name if ip_subnet else "",
-            "subnet_cidr": ip_subnet.cidr if ip_subnet else ""
-        })
-    return jsonify(result), 200
+    result = [serialize_ip(ip, subnet_lookup.get(ip.subnet_id)) for ip in ips]
+    return jsonify(result), 200, {**page_headers(total, next_cursor), **etag_headers(tag)}
+
+@api_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_ips():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"msg": "Missing search query"}), 400
+    tag = str(current())
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    try:
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_PAGE_SIZE)
+        query = search_query(q)
+    except ValueError as e:
+        return jsonify({"msg": f"Invalid search: {e}"}), 400
+
+    total = query.with_entities(db.func.count(IPAddress.id)).scalar()
+    try:
+        ips, next_cursor = paginate(query, limit, request.args.get('after'))
+    except ValueError:
+        return jsonify({"msg": "Invalid cursor"}), 400
+
+    subnet_lookup = {s.id: s for s in Subnet.query.filter(Subnet.id.in_({ip.subnet_id for ip in ips}))}
+    result = [serialize_ip(ip, subnet_lookup.get(ip.subnet_id)) for ip in ips]
+    return jsonify(result), 200, {**page_headers(total, next_cursor), **etag_headers(tag)}
 
 @api_bp.route('/ips', methods=['POST'])
 @jwt_required()
+@writes_data
 def add_ip():
     data = request.get_json()
     subnet_id = data.get('subnet_id')
@@ -223,48 +575,36 @@ def add_ip():
     selected_subnet = Subnet.query.get_or_404(subnet_id)
     
     # Find all subnets that could contain this IP (selected subnet and all its children)
-    def get_all_child_ids(parent_id):
-        children = Subnet.query.filter_by(parent_id=parent_id).all()
-        child_ids = [parent_id]
-        for child in children:
-            child_ids.extend(get_all_child_ids(child.id))
-        return child_ids
-    
-    all_subnet_ids = get_all_child_ids(subnet_id)
-    candidate_subnets = Subnet.query.filter(Subnet.id.in_(all_subnet_ids)).all()
-    
-    # Find the most specific (smallest) subnet that contains this IP
-    best_match = None
-    smallest_prefix = -1
-    
-    for subnet in candidate_subnets:
-        try:
-            network = ipaddress.ip_network(subnet.cidr)
-            if ip_obj in network:
-                # Get prefix length (e.g., /24, /16)
-                prefix_len = network.prefixlen
-                if prefix_len > smallest_prefix:
-                    smallest_prefix = prefix_len
-                    best_match = subnet
-        except ValueError:
-            continue
-    
+    all_subnet_ids = set(subtree_ids(selected_subnet))
+
+    # Find the most specific (longest prefix) subnet in the hierarchy that contains this IP
+    best_match_id = next((sid for sid in subnet_index().matches(ip_obj) if sid in all_subnet_ids), None)
+    best_match = db.session.get(Subnet, best_match_id) if best_match_id is not None else None
+
     if not best_match:
         return jsonify({"msg": f"IP {ip_addr} does not match any subnet in the hierarchy"}), 400
 
     # Check if IP already exists in the best matching subnet
-    if IPAddress.query.filter_by(subnet_id=best_match.id, ip_address=ip_addr).first():
+    if IPAddress.query.filter_by(subnet_id=best_match.id, address=ip_obj).first():
         return jsonify({"msg": f"IP address already exists in subnet {best_match.name}"}), 400
 
     new_ip = IPAddress(
         subnet_id=best_match.id,
-        ip_address=ip_addr,
+        ip_address=str(ip_obj),
         dns_name=data.get('dns_name', ''),
         architecture=data.get('architecture', ''),
         function=data.get('function', '')
     )
     db.session.add(new_ip)
-    db.session.commit()
+    try:
+        db.session.flush()
+        log_changes(IP, [new_ip.id])
+        bump([best_match.id])
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race against a concurrent insert of the same address
+        db.session.rollback()
+        return jsonify({"msg": f"IP address already exists in subnet {best_match.name}"}), 400
     
     return jsonify({
         "msg": "IP added",
@@ -275,6 +615,7 @@ def add_ip():
 
 @api_bp.route('/ips/<int:id>', methods=['PUT'])
 @jwt_required()
+@writes_data
 def update_ip(id):
     ip = IPAddress.query.get_or_404(id)
     data = request.get_json()
@@ -283,55 +624,166 @@ def update_ip(id):
     ip.architecture = data.get('architecture', ip.architecture)
     ip.function = data.get('function', ip.function)
     
+    log_changes(IP, [ip.id])
+    bump([ip.subnet_id])
     db.session.commit()
     return jsonify({"msg": "IP updated"}), 200
 
 @api_bp.route('/ips/<int:id>', methods=['DELETE'])
 @jwt_required()
+@writes_data
 def delete_ip(id):
     ip = IPAddress.query.get_or_404(id)
     db.session.delete(ip)
+    log_changes(IP, [ip.id], DELETE)
+    bump([ip.subnet_id])
     db.session.commit()
     return jsonify({"msg": "IP deleted"}), 200
 
+# --- Bulk IP operations ---
+
+def _bulk_items():
+    """Items of a bulk request body (a JSON array or {"items": [...]}), or None if invalid."""
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    return items if isinstance(items, list) else None
+
+def _bulk_response(action, results, status):
+    done = sum(1 for r in results if r['status'] == status)
+    return jsonify({
+        "msg": f"Bulk {action} finished",
+        status: done,
+        "errors": len(results) - done,
+        "results": results,
+    }), 200
+
+def _bulk_request(handler, action, status):
+    items = _bulk_items()
+    if items is None:
+        return jsonify({"msg": "Expected a JSON array of items"}), 400
+    if len(items) > MAX_BULK_ITEMS:
+        return jsonify({"msg": f"At most {MAX_BULK_ITEMS} items per request"}), 400
+    results = handler(items)
+    done = [r for r in results if r['status'] == status]
+    log_changes(IP, [r['id'] for r in done], DELETE if status == 'deleted' else UPSERT)
+    bump({r['subnet_id'] for r in done})
+    db.session.commit()
+    return _bulk_response(action, results, status)
+
+@api_bp.route('/ips/bulk', methods=['POST'])
+@jwt_required()
+@writes_data
+def bulk_add_ips():
+    return _bulk_request(bulk_create, 'create', 'created')
+
+@api_bp.route('/ips/bulk', methods=['PATCH'])
+@jwt_required()
+@writes_data
+def bulk_update_ips():
+    return _bulk_request(bulk_update, 'update', 'updated')
+
+@api_bp.route('/ips/bulk', methods=['DELETE'])
+@jwt_required()
+@writes_data
+def bulk_delete_ips():
+    return _bulk_request(bulk_delete, 'delete', 'deleted')
+
+# --- Change feed ---
+
+def _address_key(address):
+    # ipaddress objects of different versions do not compare; sort like IPKey does
+    return (address.version, int(address)) if address is not None else (0, 0)
+
+@api_bp.route('/changes', methods=['GET'])
+@jwt_required()
+def get_changes():
+    try:
+        since = int(request.args['since'])
+    except (KeyError, ValueError):
+        return jsonify({"msg": "since must be a revision number"}), 400
+    revision = current()
+    tag = str(revision)
+    if not_modified(tag):
+        return '', 304, etag_headers(tag)
+    changes = changes_between(since, revision) if since <= revision else None
+    if changes is None:
+        # Too far behind, past the pruned change log (or ahead, e.g. after a restore):
+        # start over from the full lists
+        return jsonify({"msg": "Too many changes, reload the full data", "revision": revision}), 410
+
+    subnets, deleted_subnets = changes[SUBNET]
+    ips, deleted_ips = changes[IP]
+    subnet_lookup = {s.id: s for s in Subnet.query.filter(Subnet.id.in_({ip.subnet_id for ip in ips}))}
+    return jsonify({
+        "since": since,
+        "revision": revision,
+        "subnets": {
+            "upserted": [{
+                "id": s.id,
+                "name": s.name,
+                "cidr": s.cidr,
+                "description": s.description,
+                "parent_id": s.parent_id,
+                "path": s.path,
+            } for s in sorted(subnets, key=lambda s: (_address_key(s.network_start), s.prefixlen))],
+            "deleted": deleted_subnets,
+        },
+        "ips": {
+            "upserted": [serialize_ip(ip, subnet_lookup.get(ip.subnet_id))
+                         for ip in sorted(ips, key=lambda ip: (_address_key(ip.address), ip.id))],
+            "deleted": deleted_ips,
+        },
+    }), 200, etag_headers(tag)
+
 # --- CSV Import/Export ---
 import csv
 import io
-from flask import make_response
+import zlib
+from flask import Response, make_response, stream_with_context
+from jobs import submit_import, serialize_job, expire_stale_jobs
+
+EXPORT_BATCH_SIZE = 2000
 
 @api_bp.route('/export/ips', methods=['GET'])
 @jwt_required()
 def export_ips():
-    ips = IPAddress.query.all()
-    subnet_lookup = {s.id: s for s in Subnet.query.all()}
-
-    # Sort by IP address numerically before export
-    try:
-        ips.sort(key=lambda ip: ipaddress.ip_address(ip.ip_address))
-    except ValueError:
-        pass
-
-    # Create CSV in memory
-    si = io.StringIO()
-    cw = csv.writer(si)
-
-    # Header
-    cw.writerow(['ip_address', 'dns_name', 'architecture', 'function', 'subnet_cidr', 'subnet_name'])
-
-    for ip in ips:
-        subnet = subnet_lookup.get(ip.subnet_id)
-        cw.writerow([
-            ip.ip_address,
-            ip.dns_name,
-            ip.architecture,
-            ip.function,
-            subnet.cidr if subnet else '',
-            subnet.name if subnet else ''
-        ])
-        
-    output = make_response(si.getvalue())
+    # Rows are streamed from a server-side cursor in database order, so memory
+    # stays constant regardless of the number of IPs
+    rows = db.session.execute(
+        db.select(IPAddress.ip_address, IPAddress.dns_name, IPAddress.architecture,
+                  IPAddress.function, Subnet.cidr, Subnet.name)
+        .outerjoin(Subnet, IPAddress.subnet_id == Subnet.id)
+        .order_by(IPAddress.address, IPAddress.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    use_gzip = request.accept_encodings['gzip'] > 0
+
+    def generate():
+        si = io.StringIO()
+        cw = csv.writer(si)
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None  # wbits=31: gzip framing
+
+        def flush():
+            chunk = si.getvalue().encode('utf-8')
+            si.seek(0)
+            si.truncate()
+            return compressor.compress(chunk) if compressor else chunk
+
+        # Header
+        cw.writerow(['ip_address', 'dns_name', 'architecture', 'function', 'subnet_cidr', 'subnet_name'])
+        for batch in rows.partitions():
+            for ip_address, dns_name, architecture, function, cidr, name in batch:
+                cw.writerow([ip_address, dns_name, architecture, function, cidr or '', name or ''])
+            yield flush()
+        yield flush()
+        if compressor:
+            yield compressor.flush()
+
+    output = Response(stream_with_context(generate()), mimetype="text/csv")
     output.headers["Content-Disposition"] = "attachment; filename=ipam_export.csv"
-    output.headers["Content-type"] = "text/csv"
+    output.headers["Vary"] = "Accept-Encoding"
+    if use_gzip:
+        output.headers["Content-Encoding"] = "gzip"
     return output
 
 @api_bp.route('/import/ips', methods=['POST'])
@@ -346,72 +798,25 @@ def import_ips():
     if not file.filename.endswith('.csv'):
         return jsonify({"msg": "File must be a CSV"}), 400
 
-    try:
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        csv_input = csv.DictReader(stream)
-        
-        created_count = 0
-        updated_count = 0
-        errors = []
-
-        # Fetch once before the loop to avoid N+1 queries
-        all_subnets = Subnet.query.all()
-
-        for row in csv_input:
-            ip_addr = row.get('ip_address')
-            if not ip_addr:
-                continue
-
-            # Basic validation
-            try:
-                ip_obj = ipaddress.ip_address(ip_addr)
-            except ValueError:
-                errors.append(f"Invalid IP: {ip_addr}")
-                continue
-
-            best_match = None
-            smallest_prefix = -1
-            
-            for subnet in all_subnets:
-                try:
-                    network = ipaddress.ip_network(subnet.cidr)
-                    if ip_obj in network:
-                        if network.prefixlen > smallest_prefix:
-                            smallest_prefix = network.prefixlen
-                            best_match = subnet
-                except ValueError:
-                    continue
-            
-            if not best_match:
-                errors.append(f"No subnet found for IP: {ip_addr}")
-                continue
-                
-            # Check or Update
-            existing_ip = IPAddress.query.filter_by(subnet_id=best_match.id, ip_address=ip_addr).first()
-            
-            if existing_ip:
-                existing_ip.dns_name = row.get('dns_name', existing_ip.dns_name)
-                existing_ip.architecture = row.get('architecture', existing_ip.architecture)
-                existing_ip.function = row.get('function', existing_ip.function)
-                updated_count += 1
-            else:
-                new_ip = IPAddress(
-                    subnet_id=best_match.id,
-                    ip_address=ip_addr,
-                    dns_name=row.get('dns_name', ''),
-                    architecture=row.get('architecture', ''),
-                    function=row.get('function', '')
-                )
-                db.session.add(new_ip)
-                created_count += 1
+    job = submit_import(file, get_jwt_identity())
+    return jsonify({
+        "msg": "Import queued",
+        "job_id": job.id,
+        "status_url": f"/api/import/jobs/{job.id}"
+    }), 202, {"Location": f"/api/import/jobs/{job.id}"}
 
-        db.session.commit()
-        return jsonify({
-            "msg": "Import completed",
-            "created": created_count,
-            "updated": updated_count,
-            "errors": errors
-        }), 200
-
-    except Exception as e:
-        return jsonify({"msg": str(e)}), 500
+@api_bp.route('/import/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_import_job(job_id):
+    expire_stale_jobs()
+    job = ImportJob.query.get_or_404(job_id)
+    return jsonify(serialize_job(job)), 200
+
+@api_bp.route('/import/jobs/<job_id>/errors', methods=['GET'])
+@jwt_required()
+def download_import_errors(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    output = make_response(job.error_csv or "line,ip_address,error\n")
+    output.headers["Content-Disposition"] = f"attachment; filename=import_errors_{job.id}.csv"
+    output.headers["Content-type"] = "text/csv"
+    return output
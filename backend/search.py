@@ -0,0 +1,168 @@
+"""Server-side search across the IP inventory.
+
+Queries use a small filter syntax: whitespace-separated terms, each either a
+bare word (matched against every field) or `key:value`:
+
+    arch:VM cidr:10.1.0.0/16 name:pve*
+
+`*` and `?` are wildcards; a value without wildcards matches as a substring.
+Text matching is backed by trigram indexes: `pg_trgm` GIN indexes on
+PostgreSQL and an FTS5 `trigram` table (`ip_search`) on SQLite. When neither
+is available the same query runs as a plain LIKE scan.
+"""
+import ipaddress
+import shlex
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Subnet, IPAddress
+
+# Filter keys and the IPAddress/Subnet columns they search
+FIELDS = {
+    'ip': 'ip_address',
+    'name': 'dns_name',
+    'dns': 'dns_name',
+    'arch': 'architecture',
+    'function': 'function',
+    'fn': 'function',
+    'subnet': 'subnet_name',
+}
+IP_TEXT_COLUMNS = ('ip_address', 'dns_name', 'architecture', 'function')
+
+# SQLite FTS5 shadow of the ip_address text columns (rowid = ip_address.id)
+ip_search = db.table('ip_search', db.column('rowid'), *[db.column(c) for c in IP_TEXT_COLUMNS])
+
+TRGM_INDEXES = [
+    ('ix_ip_address_ip_address_trgm', 'ip_address', 'ip_address'),
+    ('ix_ip_address_dns_name_trgm', 'ip_address', 'dns_name'),
+    ('ix_ip_address_architecture_trgm', 'ip_address', 'architecture'),
+    ('ix_ip_address_function_trgm', 'ip_address', 'function'),
+    ('ix_subnet_name_trgm', 'subnet', 'name'),
+]
+
+
+def _like_pattern(value):
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if '*' in value or '?' in value:
+        return escaped.replace('*', '%').replace('?', '_')
+    return f'%{escaped}%'
+
+
+def parse_query(q):
+    """Split a search string into [(field or None, value)] terms.
+
+    Unknown keys are treated as bare words. Raises ValueError for an invalid
+    `cidr:` network.
+    """
+    try:
+        tokens = shlex.split(q)
+    except ValueError:
+        tokens = q.split()
+    terms = []
+    for token in tokens:
+        key, sep, value = token.partition(':')
+        key = key.lower()
+        if sep and (key in FIELDS or key == 'cidr') and value:
+            if key == 'cidr':
+                terms.append(('cidr', ipaddress.ip_network(value, strict=False)))
+            else:
+                terms.append((FIELDS[key], value))
+        else:
+            terms.append((None, token))
+    return terms
+
+
+def _fts_available():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    found = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ip_search'")).first()
+    return found is not None
+
+
+def _subnet_ids(*conditions):
+    """Ids of the subnets matching any of `conditions`.
+
+    The subnet table is small, so its matches are resolved up front and the
+    IP query filters on `subnet_id IN (...)` instead of joining Subnet, which
+    keeps every condition on ip_address answerable from an index.
+    """
+    return db.session.scalars(db.select(Subnet.id).where(db.or_(*conditions))).all()
+
+
+def _text_match(field, pattern, use_fts):
+    if field == 'subnet_name':
+        return IPAddress.subnet_id.in_(_subnet_ids(Subnet.name.ilike(pattern, escape='\\')))
+    if use_fts:
+        # LIKE against the FTS5 trigram table is answered from the full-text index,
+        # but only when no ESCAPE clause is attached
+        column = ip_search.c[field]
+        match = column.like(pattern, escape='\\') if '\\' in pattern else column.like(pattern)
+        return IPAddress.id.in_(db.select(ip_search.c.rowid).where(match))
+    return getattr(IPAddress, field).ilike(pattern, escape='\\')
+
+
+def _term_filter(field, value, use_fts):
+    if field == 'cidr':
+        return IPAddress.address.between(value.network_address, value.broadcast_address)
+    if field == 'ip_address' and '*' not in value and '?' not in value:
+        try:
+            return IPAddress.address == ipaddress.ip_address(value)
+        except ValueError:
+            pass
+    pattern = _like_pattern(value)
+    if field is not None:
+        return _text_match(field, pattern, use_fts)
+    subnet_ids = _subnet_ids(Subnet.name.ilike(pattern, escape='\\'),
+                             Subnet.cidr.ilike(pattern, escape='\\'))
+    return db.or_(*[_text_match(column, pattern, use_fts) for column in IP_TEXT_COLUMNS],
+                  IPAddress.subnet_id.in_(subnet_ids))
+
+
+def search_query(q):
+    """IPAddress query matching all terms of `q`."""
+    use_fts = _fts_available()
+    query = IPAddress.query
+    for field, value in parse_query(q):
+        query = query.filter(_term_filter(field, value, use_fts))
+    return query
+
+
+def create_search_indexes(conn):
+    """Create the trigram search indexes for the connection's dialect, if supported."""
+    if conn.dialect.name == 'postgresql':
+        try:
+            with conn.begin_nested():
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except SQLAlchemyError:
+            print('pg_trgm is not available; search will use sequential scans.')
+            return
+        for name, table, column in TRGM_INDEXES:
+            conn.execute(text(
+                f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)'))
+    elif conn.dialect.name == 'sqlite':
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ip_search'")).first()
+        if exists:
+            return
+        columns = ', '.join(IP_TEXT_COLUMNS)
+        new_values = ', '.join(f'new.{c}' for c in IP_TEXT_COLUMNS)
+        old_values = ', '.join(f'old.{c}' for c in IP_TEXT_COLUMNS)
+        try:
+            with conn.begin_nested():
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE ip_search USING fts5({columns}, content='ip_address', "
+                    f"content_rowid='id', tokenize='trigram')"))
+        except SQLAlchemyError:
+            print('SQLite FTS5 trigram tokenizer is not available; search will use LIKE scans.')
+            return
+        conn.execute(text(
+            f"CREATE TRIGGER ip_search_ai AFTER INSERT ON ip_address BEGIN "
+            f"INSERT INTO ip_search(rowid, {columns}) VALUES (new.id, {new_values}); END"))
+        conn.execute(text(
+            f"CREATE TRIGGER ip_search_ad AFTER DELETE ON ip_address BEGIN "
+            f"INSERT INTO ip_search(ip_search, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"))
+        conn.execute(text(
+            f"CREATE TRIGGER ip_search_au AFTER UPDATE OF {columns} ON ip_address BEGIN "
+            f"INSERT INTO ip_search(ip_search, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO ip_search(rowid, {columns}) VALUES (new.id, {new_values}); END"))
+        conn.execute(text("INSERT INTO ip_search(ip_search) VALUES ('rebuild')"))
@@ -0,0 +1,138 @@
+"""Response encoding: fast JSON, optional MessagePack, compression.
+
+`FastJSONProvider` replaces Flask's JSON provider, so every `jsonify()` goes
+through it. It serializes with orjson when installed (several times faster
+than the stdlib `json` module on the large IP lists) and falls back to the
+stdlib otherwise. Values orjson does not know natively, such as dates, are
+passed to Flask's `default` hook, so the output does not depend on which
+serializer runs. Keys are not sorted. orjson rejects integers wider than 64
+bits, such as the address counts of IPv6 prefixes shorter than /64; those
+responses are encoded by the stdlib instead.
+
+Clients that prefer `application/msgpack` in their `Accept` header get
+MessagePack instead of JSON when `msgpack` is installed. MessagePack has the
+same 64-bit limit; responses it cannot hold are sent as JSON. With `msgpack`
+installed every response carries `Vary: Accept`, and `representation_tag()`
+gives MessagePack requests their own ETag (`revisions.etag_headers()` and
+`not_modified()` use it), so caches never swap one format for the other.
+
+`compress_response` runs after every request and compresses JSON and
+MessagePack bodies of at least COMPRESS_MIN_SIZE bytes with brotli (when the
+`brotli` module is installed and the client accepts `br`) or gzip. Streamed
+responses, such as the CSV export, are left alone. A compressed response's
+`ETag` becomes weak, as different encodings must not share a strong tag;
+`revisions.not_modified()` compares weakly, so revalidation keeps working.
+"""
+import gzip
+import os
+from flask import request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+COMPRESSIBLE_MIMETYPES = {'application/json', MSGPACK_MIMETYPE}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider using orjson when available, with MessagePack negotiation."""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode()
+
+    def _orjson_dumps(self, obj, indent=False):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=options)
+        except orjson.JSONEncodeError:  # e.g. an integer wider than 64 bits
+            return super().dumps(obj, indent=2 if indent else None).encode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if wants_msgpack():
+            try:
+                body = msgpack.packb(obj, default=self.default)
+            except (OverflowError, TypeError):  # e.g. an integer wider than 64 bits; use JSON
+                pass
+            else:
+                response = self._app.response_class(body, mimetype=MSGPACK_MIMETYPE)
+                response.vary.add('Accept')
+                return response
+        if orjson is None:
+            response = super().response(obj)
+        else:
+            # Pretty-printed in debug mode, like Flask's provider
+            indent = (self.compact is None and self._app.debug) or self.compact is False
+            response = self._app.response_class(self._orjson_dumps(obj, indent), mimetype=self.mimetype)
+        if msgpack is not None and has_request_context():
+            response.vary.add('Accept')
+        return response
+
+
+def wants_msgpack():
+    """True if the current request prefers MessagePack over JSON and it is available."""
+    if msgpack is None or not has_request_context():
+        return False
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def representation_tag(tag):
+    """ETag value `tag` for the format the current request negotiates."""
+    return f'{tag}-msgpack' if wants_msgpack() else tag
+
+
+def _encoding():
+    """The best compression the client accepts: 'br', 'gzip' or None."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook compressing large JSON and MessagePack responses."""
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    encoding = _encoding()
+    if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag, weak=True)
+    return response
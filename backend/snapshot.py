@@ -0,0 +1,304 @@
+"""Read-only snapshot of the address space, shared by all workers of a host.
+
+The snapshot is one binary file that every gunicorn worker maps with `mmap`,
+so the data is held once in the page cache instead of once per process:
+
+    header    MAGIC, data revision, subnet count, address count
+    subnets   one SUBNET_RECORD per subnet, ordered by IP version, network
+              start and prefix length: id, container (record number of the
+              smallest other subnet whose range contains this one, -1 for
+              none), IP version, prefix length, network start/end, position
+              and number of its addresses
+    addresses the 16-byte big-endian addresses of every subnet, each
+              subnet's run sorted ascending
+
+A range of the address space is found by bisecting the network starts. The
+subnets enclosing its first address are the subnet starting just before it
+and that subnet's containers. Containers are computed from the address
+ranges, not `parent_id`, which need not follow CIDR containment.
+
+Readers only use a snapshot whose revision equals the current data revision
+(see revisions.py), so it never answers with data older than the database.
+When it is stale, one worker rebuilds it in a background thread: an exclusive
+`flock` on a lock file keeps the other workers out, and the new file is
+written next to the old one and renamed over it, so readers always see a
+complete file. Workers notice the rename and remap on next use. Until the
+new file is in place callers fall back to SQL.
+
+Snapshots need `fcntl` (POSIX); without it they are disabled.
+"""
+import bisect
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from models import db, Subnet, IPAddress
+from revisions import current
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', tempfile.gettempdir())
+SNAPSHOT_BATCH_SIZE = 10000
+
+MAGIC = b'IPAMSNP3'
+HEADER = struct.Struct('<8sQQQ')
+SUBNET_RECORD = struct.Struct('<qqBB16s16sQQ')
+ADDRESS_SIZE = 16
+
+_lock = threading.Lock()
+_mapped = None  # (file identity, Snapshot)
+_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ipam-snapshot')
+_build_pending = False
+
+
+class AddressArray:
+    """Zero-copy sequence of one subnet's addresses as ascending integers."""
+
+    def __init__(self, view):
+        self._view = view
+
+    def __len__(self):
+        return len(self._view) // ADDRESS_SIZE
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return int.from_bytes(self._view[i * ADDRESS_SIZE:(i + 1) * ADDRESS_SIZE], 'big')
+
+    def between(self, first, last):
+        """Yield the addresses from `first` to `last` (inclusive) in ascending order."""
+        for i in range(bisect.bisect_left(self, first), bisect.bisect_right(self, last)):
+            yield self[i]
+
+
+class Snapshot:
+    """A mapped snapshot file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, self.revision, self.subnet_count, self.address_count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an IPAM snapshot')
+        start = HEADER.size
+        self._subnets = view[start:start + self.subnet_count * SUBNET_RECORD.size]
+        self._addresses = view[start + len(self._subnets):]
+        self._starts = _Column(self._subnets, SUBNET_RECORD.size, lambda records, offset:
+                               (records[offset + 16], bytes(records[offset + 18:offset + 34])))
+
+    @property
+    def size(self):
+        return len(self._map)
+
+    def _record(self, i):
+        """(id, container, version, prefixlen, start, end, offset, count) of record `i`."""
+        return _decode(SUBNET_RECORD.unpack_from(self._subnets, i * SUBNET_RECORD.size))
+
+    def subnets_starting(self, version, first, last):
+        """Yield the records of `version` subnets whose network address lies between `first` and `last`."""
+        lo = bisect.bisect_left(self._starts, (version, first.to_bytes(16, 'big')))
+        hi = bisect.bisect_right(self._starts, (version, last.to_bytes(16, 'big')))
+        for i in range(lo, hi):
+            yield self._record(i)
+
+    def enclosing(self, version, address):
+        """Yield the records of the subnets containing `address`, most specific first."""
+        i = bisect.bisect_right(self._starts, (version, address.to_bytes(16, 'big'))) - 1
+        if i < 0 or self._starts[i][0] != version:
+            return
+        # CIDR ranges are nested or disjoint, so every subnet containing `address`
+        # is the last one starting at or before it, or one of its containers
+        while i >= 0:
+            record = self._record(i)
+            if record[4] <= address <= record[5]:
+                yield record
+            i = record[1]
+
+    def used_addresses(self, version, first, last):
+        """Distinct addresses between `first` and `last` across all subnets, ascending."""
+        records = [record for record in self.enclosing(version, first) if record[4] < first]
+        records.extend(self.subnets_starting(version, first, last))
+        runs = []
+        for _, _, _, _, _, _, offset, count in records:
+            if count:
+                array = AddressArray(self._addresses[offset * ADDRESS_SIZE:(offset + count) * ADDRESS_SIZE])
+                runs.append(array.between(first, last))
+        previous = None
+        for value in heapq.merge(*runs):
+            if value != previous:
+                yield value
+                previous = value
+
+
+class _Column:
+    """One field of a table of fixed-size records, as a sequence for bisect."""
+
+    def __init__(self, records, size, field):
+        self._records = records
+        self._size = size
+        self._field = field
+
+    def __len__(self):
+        return len(self._records) // self._size
+
+    def __getitem__(self, i):
+        return self._field(self._records, i * self._size)
+
+
+def _decode(record):
+    subnet_id, container, version, prefixlen, start, end, offset, count = record
+    return (subnet_id, container, version, prefixlen,
+            int.from_bytes(start, 'big'), int.from_bytes(end, 'big'), offset, count)
+
+
+def snapshot_path():
+    """Snapshot file of the configured database (one per database and host)."""
+    uri = current_app.config['SQLALCHEMY_DATABASE_URI']
+    return os.path.join(SNAPSHOT_DIR, f'ipam-snapshot-{hashlib.sha1(uri.encode()).hexdigest()[:12]}.bin')
+
+
+def _map(path):
+    """The Snapshot at `path`, remapped if the file was replaced, or None if missing."""
+    global _mapped
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if _mapped is None or _mapped[0] != identity:
+            # The previous map stays valid for readers still holding it
+            _mapped = (identity, Snapshot(path))
+        return _mapped[1]
+
+
+def fresh_snapshot():
+    """The snapshot if it matches the current data revision, else None.
+
+    A stale or missing snapshot is rebuilt in the background; use SQL meanwhile.
+    """
+    if fcntl is None:
+        return None
+    path = snapshot_path()
+    snapshot = _map(path)
+    if snapshot is not None and snapshot.revision == current():
+        return snapshot
+    _schedule_build(path)
+    return None
+
+
+def _schedule_build(path):
+    global _build_pending
+    with _lock:
+        if _build_pending:
+            return
+        _build_pending = True
+    _builder.submit(_build_in_background, current_app._get_current_object(), path)
+
+
+def _build_in_background(app, path):
+    global _build_pending
+    try:
+        with app.app_context():
+            build_snapshot(path)
+    finally:
+        with _lock:
+            _build_pending = False
+
+
+def build_snapshot(path):
+    """Write a snapshot of the current data to `path`, unless another worker is at it.
+
+    Returns True if a snapshot was written.
+    """
+    with open(path + '.lock', 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        # Read the revision first: if it is still current when the snapshot is
+        # used, no write can have been committed while the data was read
+        revision = current()
+        existing = _map(path)
+        if existing is not None and existing.revision == revision:
+            return False
+        directory = os.path.dirname(path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.ipam-snapshot-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                _write(out, revision)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
+
+def _write(out, revision):
+    subnets = db.session.execute(
+        db.select(Subnet.id, Subnet.network_start, Subnet.network_end, Subnet.prefixlen)
+        .where(Subnet.network_start.isnot(None))
+        .order_by(Subnet.network_start, Subnet.prefixlen)).all()
+    # Addresses go first (behind a placeholder header and subnet tables), grouped by
+    # subnet in id order; the raw 17-byte keys are read without building ip objects
+    out.write(b'\0' * (HEADER.size + len(subnets) * SUBNET_RECORD.size))
+    raw_address = db.type_coerce(IPAddress.address, db.LargeBinary)
+    rows = db.session.execute(
+        db.select(IPAddress.subnet_id, raw_address)
+        .order_by(IPAddress.subnet_id, IPAddress.address)
+        .execution_options(yield_per=SNAPSHOT_BATCH_SIZE))
+    counts = {}
+    offsets = {}
+    total = 0
+    for subnet_id, key in rows:
+        if subnet_id not in offsets:
+            offsets[subnet_id] = total
+        counts[subnet_id] = counts.get(subnet_id, 0) + 1
+        out.write(bytes(key)[1:])
+        total += 1
+
+    out.seek(0)
+    out.write(HEADER.pack(MAGIC, revision, len(subnets), total))
+    # Records come in start order, so the subnets containing the current one are on
+    # a stack of still open ranges
+    open_ranges = []  # (version, end, record number)
+    for i, (subnet_id, network_start, network_end, prefixlen) in enumerate(subnets):
+        version, start, end = network_start.version, int(network_start), int(network_end)
+        while open_ranges and (open_ranges[-1][0] != version or open_ranges[-1][1] < start):
+            open_ranges.pop()
+        container = open_ranges[-1][2] if open_ranges else -1
+        open_ranges.append((version, end, i))
+        out.write(SUBNET_RECORD.pack(
+            subnet_id, container, version, prefixlen, start.to_bytes(16, 'big'), end.to_bytes(16, 'big'),
+            offsets.get(subnet_id, 0), counts.get(subnet_id, 0)))
+    out.seek(0, os.SEEK_END)
+
+
+def snapshot_stats():
+    """Description of the snapshot this worker has mapped (for /cache/stats)."""
+    if fcntl is None:
+        return {"enabled": False}
+    snapshot = _map(snapshot_path())
+    if snapshot is None:
+        return {"enabled": True, "revision": None}
+    return {
+        "enabled": True,
+        "revision": snapshot.revision,
+        "current": snapshot.revision == current(),
+        "subnets": snapshot.subnet_count,
+        "addresses": snapshot.address_count,
+        "bytes": snapshot.size,
+    }
@@ -28,6 +28,13 @@ const ARCH_BADGE = {
     'IoT Device':   'bg-green-100 text-green-800 dark:bg-green-900/40 dark:text-green-300',
 };
 
+const IPS_PAGE_SIZE = 500;
+const IMPORT_POLL_INTERVAL = 1000;
+// Give up polling an import job after this long; it keeps running on the server
+const IMPORT_POLL_TIMEOUT = 60 * 60 * 1000;
+// Levels of the subnet tree loaded at once; deeper branches load when expanded
+const SUBNET_TREE_DEPTH = 3;
+
 const MODAL_INPUT = 'w-full px-3 py-2 text-sm border border-slate-300 dark:border-slate-600 rounded-lg bg-white dark:bg-slate-700 text-slate-900 dark:text-white placeholder-slate-400 focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent transition-shadow';
 const MODAL_LABEL = 'block text-xs font-medium text-slate-600 dark:text-slate-400 mb-1.5';
 
@@ -35,9 +42,17 @@ const Dashboard = () => {
     const { logout, user } = useAuth();
     const { theme, toggleTheme } = useTheme();
     const { t } = useTranslation();
-    const [subnets, setSubnets] = useState([]);
+    const [subnetTree, setSubnetTree] = useState([]);
+    const [branches, setBranches] = useState(new Map()); // subnet id → children loaded on expand
     const [selectedSubnet, setSelectedSubnet] = useState(null);
     const [ips, setIps] = useState([]);
+    const [ipsTotal, setIpsTotal] = useState(0);
+    const [ipsCursor, setIpsCursor] = useState(null);
+    const [ipsLoadingMore, setIpsLoadingMore] = useState(false);
+    const [searchResults, setSearchResults] = useState(null); // null = not searching
+    const [searchTotal, setSearchTotal] = useState(0);
+    const [searchCursor, setSearchCursor] = useState(null);
+    const searchRequestRef = useRef(0);
     const [showSubnetModal, setShowSubnetModal] = useState(false);
     const [showIpModal, setShowIpModal] = useState(false);
     const [showSettingsModal, setShowSettingsModal] = useState(false);
@@ -107,19 +122,111 @@ const Dashboard = () => {
 
     useEffect(() => {
         if (selectedSubnet) fetchIps(selectedSubnet.id);
-        else setIps([]);
+        else { setIps([]); setIpsTotal(0); setIpsCursor(null); }
     }, [selectedSubnet]);
 
     const fetchSubnets = async () => {
-        try { const res = await api.get('/subnets'); setSubnets(res.data); }
+        try {
+            // Reload the branches expanded on demand as well; those of deleted subnets drop out
+            const branchIds = [...branches.keys()];
+            const [res, ...reloaded] = await Promise.allSettled([
+                api.get('/subnets/tree', { params: { depth: SUBNET_TREE_DEPTH } }),
+                ...branchIds.map(id => api.get('/subnets/tree', { params: { root: id, depth: SUBNET_TREE_DEPTH } })),
+            ]);
+            if (res.status === 'rejected') throw res.reason;
+            setSubnetTree(res.value.data);
+            setBranches(new Map(branchIds.flatMap((id, i) => reloaded[i].status === 'fulfilled' ? [[id, reloaded[i].value.data]] : [])));
+        }
+        catch (err) { console.error('Failed to fetch subnets', err); }
+    };
+
+    const loadBranch = async (id) => {
+        try {
+            const res = await api.get('/subnets/tree', { params: { root: id, depth: SUBNET_TREE_DEPTH } });
+            setBranches(prev => new Map(prev).set(id, res.data));
+        }
         catch (err) { console.error('Failed to fetch subnets', err); }
     };
 
-    const fetchIps = async (subnetId) => {
-        try { const res = await api.get(`/subnets/${subnetId}/ips`); setIps(res.data); }
+    // Keyset-paginated: the first page replaces the list, `after` appends the next page
+    const fetchIps = async (subnetId, after = null) => {
+        try {
+            const params = { limit: IPS_PAGE_SIZE, ...(after && { after }) };
+            const res = await api.get(`/subnets/${subnetId}/ips`, { params });
+            setIps(prev => after ? [...prev, ...res.data] : res.data);
+            setIpsCursor(res.headers['x-next-cursor'] || null);
+            setIpsTotal(Number(res.headers['x-total-count'] ?? res.data.length));
+        }
         catch (err) { console.error('Failed to fetch IPs', err); }
     };
 
+    // Server-side search across all subnets; stale responses are dropped
+    const fetchSearch = async (term, after = null) => {
+        const requestId = ++searchRequestRef.current;
+        try {
+            const params = { q: term, limit: IPS_PAGE_SIZE, ...(after && { after }) };
+            const res = await api.get('/search', { params });
+            if (requestId !== searchRequestRef.current) return;
+            setSearchResults(prev => after ? [...(prev || []), ...res.data] : res.data);
+            setSearchCursor(res.headers['x-next-cursor'] || null);
+            setSearchTotal(Number(res.headers['x-total-count'] ?? res.data.length));
+        } catch (err) {
+            if (requestId !== searchRequestRef.current) return;
+            setSearchResults([]); setSearchCursor(null); setSearchTotal(0);
+            if (err.response?.status === 400) showToast(err.response.data?.msg, 'error');
+            else console.error('Search failed', err);
+        }
+    };
+
+    useEffect(() => {
+        const term = searchTerm.trim();
+        if (!term) { searchRequestRef.current++; setSearchResults(null); setSearchCursor(null); return; }
+        const timer = setTimeout(() => fetchSearch(term), 250);
+        return () => clearTimeout(timer);
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [searchTerm]);
+
+    const refreshIps = () => {
+        if (selectedSubnet) fetchIps(selectedSubnet.id);
+        if (searchTerm.trim()) fetchSearch(searchTerm.trim());
+    };
+
+    // Live updates: the event stream announces every committed write; reloading is
+    // cheap because unchanged lists come back as 304 via their ETags
+    const onChangeRef = useRef(null);
+    onChangeRef.current = (change) => {
+        fetchSubnets();
+        if (selectedSubnet && change.ips !== 0) fetchIps(selectedSubnet.id);
+    };
+
+    useEffect(() => {
+        let source = null;
+        let retryTimer = null;
+        const connect = () => {
+            // EventSource cannot send headers, so the token goes in the query string
+            const token = localStorage.getItem('token');
+            const url = import.meta.env.VITE_EVENTS_URL || `${api.defaults.baseURL}/events`;
+            source = new EventSource(`${url}?token=${encodeURIComponent(token || '')}`);
+            source.addEventListener('change', (e) => onChangeRef.current?.(JSON.parse(e.data)));
+            source.onerror = () => {
+                // Closed on token expiry or server restart: reconnect with the current token
+                source.close();
+                retryTimer = setTimeout(connect, 3000);
+            };
+        };
+        connect();
+        return () => { clearTimeout(retryTimer); source?.close(); };
+    }, []);
+
+    const loadMoreIps = async () => {
+        setIpsLoadingMore(true);
+        try {
+            if (searchResults) { if (searchCursor) await fetchSearch(searchTerm.trim(), searchCursor); }
+            else if (selectedSubnet && ipsCursor) await fetchIps(selectedSubnet.id, ipsCursor);
+        }
+        finally { setIpsLoadingMore(false); }
+    };
+
     const handleCreateSubnet = async (e) => {
         e.preventDefault();
         setSubnetFormLoading(true);
@@ -137,10 +244,12 @@ const Dashboard = () => {
         e.preventDefault();
         setSubnetFormLoading(true);
         try {
-            await api.put(`/subnets/${editingSubnet.id}`, editingSubnet);
+            const { name, cidr, description } = editingSubnet;
+            await api.put(`/subnets/${editingSubnet.id}`, { name, cidr, description });
             setEditingSubnet(null);
             fetchSubnets();
             if (selectedSubnet?.id === editingSubnet.id) setSelectedSubnet({ ...selectedSubnet, ...editingSubnet });
+            refreshIps(); // a CIDR change may have moved IPs between subnets
             showToast(t('subnet_updated', 'Subnet updated'), 'success');
         } catch (err) { showToast(err.response?.data?.msg || t('error_update_subnet'), 'error'); }
         finally { setSubnetFormLoading(false); }
@@ -153,7 +262,7 @@ const Dashboard = () => {
             await api.post('/ips', { ...newIp, subnet_id: selectedSubnet.id });
             setShowIpModal(false);
             setNewIp({ ip_address: '', dns_name: '', architecture: 'VM', function: '' });
-            fetchIps(selectedSubnet.id);
+            refreshIps();
             showToast(t('ip_added', 'IP address added'), 'success');
         } catch (err) { showToast(err.response?.data?.msg || t('error_add_ip'), 'error'); }
         finally { setIpFormLoading(false); }
@@ -165,7 +274,7 @@ const Dashboard = () => {
         try {
             await api.put(`/ips/${editingIp.id}`, editingIp);
             setEditingIp(null);
-            fetchIps(selectedSubnet.id);
+            refreshIps();
             showToast(t('ip_updated', 'IP address updated'), 'success');
         } catch (err) { showToast(err.response?.data?.msg || t('error_update_ip'), 'error'); }
         finally { setIpFormLoading(false); }
@@ -178,16 +287,21 @@ const Dashboard = () => {
 
     const handleDeleteSubnet = (e, id, name) => {
         e.preventDefault(); e.stopPropagation();
-        setDeleteConfirm({ show: true, type: 'subnet', id, name });
+        setDeleteConfirm({ show: true, type: 'subnet', id, name, recursive: false, rehome: false });
     };
 
     const confirmDelete = async () => {
-        const { type, id } = deleteConfirm;
+        const { type, id, recursive, rehome } = deleteConfirm;
         setDeleteConfirm({ show: false, type: null, id: null, name: '' });
         try {
-            if (type === 'ip') { await api.delete(`/ips/${id}`); fetchIps(selectedSubnet.id); }
-            else if (type === 'subnet') { await api.delete(`/subnets/${id}`); if (selectedSubnet?.id === id) setSelectedSubnet(null); fetchSubnets(); }
-        } catch (err) { console.error(err); }
+            if (type === 'ip') { await api.delete(`/ips/${id}`); refreshIps(); }
+            else if (type === 'subnet') {
+                await api.delete(`/subnets/${id}`, { params: { ...(recursive && { recursive: true }), ...(rehome && { rehome: true }) } });
+                if (selectedSubnet?.id === id || (recursive && selectedSubnet?.path?.includes(`/${id}/`))) setSelectedSubnet(null);
+                fetchSubnets();
+                if (rehome) refreshIps();
+            }
+        } catch (err) { console.error(err); showToast(err.response?.data?.msg || t('error_delete', 'Delete failed'), 'error'); }
     };
 
     const cancelDelete = () => setDeleteConfirm({ show: false, type: null, id: null, name: '' });
@@ -197,8 +311,17 @@ const Dashboard = () => {
         setContextMenu({ show: true, x: e.pageX, y: e.pageY, subnet });
     };
 
-    const toggleCollapse = (e, id) => {
+    const childrenOf = (subnet) => subnet.children ?? branches.get(subnet.id);
+
+    const toggleCollapse = (e, subnet) => {
         e.stopPropagation();
+        const id = subnet.id;
+        if (!childrenOf(subnet)) {
+            // Beyond the loaded depth: fetch the branch and show it expanded
+            loadBranch(id);
+            setCollapsedSubnets(prev => { const next = new Set(prev); next.delete(id); return next; });
+            return;
+        }
         setCollapsedSubnets(prev => {
             const next = new Set(prev);
             if (next.has(id)) next.delete(id); else next.add(id);
@@ -206,35 +329,25 @@ const Dashboard = () => {
         });
     };
 
-    const subnetById = useMemo(() => new Map(subnets.map(s => [s.id, s])), [subnets]);
-
-    const organizeSubnets = useMemo(() => {
-        const buildTree = (parentId) =>
-            subnets.filter(s => s.parent_id === parentId).map(s => ({ ...s, children: buildTree(s.id) }));
-        return buildTree(null);
-    }, [subnets]);
-
-    const filteredIps = useMemo(() => {
-        const term = searchTerm.toLowerCase();
-        if (!term) return ips;
-        return ips.filter(ip =>
-            ip.ip_address.toLowerCase().includes(term) ||
-            ip.dns_name?.toLowerCase().includes(term) ||
-            ip.architecture?.toLowerCase().includes(term) ||
-            ip.function?.toLowerCase().includes(term) ||
-            ip.subnet_name?.toLowerCase().includes(term) ||
-            ip.subnet_cidr?.toLowerCase().includes(term)
-        );
-    }, [ips, searchTerm]);
-
+    // The tree arrives nested and sorted from GET /subnets/tree; index the loaded nodes in one pass
+    const subnetById = useMemo(() => {
+        const byId = new Map();
+        const index = (nodes) => nodes.forEach(s => { byId.set(s.id, s); if (s.children) index(s.children); });
+        index(subnetTree);
+        branches.forEach(index);
+        return byId;
+    }, [subnetTree, branches]);
+
+    // While a search term is set the table shows server-side search results instead
+    const visibleIps = searchResults ?? ips;
+    const visibleTotal = searchResults ? searchTotal : ipsTotal;
+    const visibleCursor = searchResults ? searchCursor : ipsCursor;
+
+    // Breadcrumb from the materialized path ('/1/5/12/') — no parent walk needed
     const getSubnetPath = (subnetId) => {
-        const path = [];
-        let current = subnetById.get(subnetId);
-        while (current) {
-            path.unshift(current);
-            current = current.parent_id ? subnetById.get(current.parent_id) : null;
-        }
-        return path;
+        const subnet = subnetById.get(subnetId);
+        if (!subnet?.path) return subnet ? [subnet] : [];
+        return subnet.path.split('/').filter(Boolean).map(id => subnetById.get(Number(id))).filter(Boolean);
     };
 
     const handleExport = async () => {
@@ -263,8 +376,23 @@ const Dashboard = () => {
         formData.append('file', file);
         setImportLoading(true);
         try {
+            // The import runs as a background job; poll its status until it finishes
             const res = await api.post('/import/ips', formData, { headers: { 'Content-Type': 'multipart/form-data' } });
-            showToast(`${t('import_success')} — ${t('import_created')}: ${res.data.created}, ${t('import_updated')}: ${res.data.updated}`, 'success');
+            let job = { status: 'queued' };
+            const deadline = Date.now() + IMPORT_POLL_TIMEOUT;
+            while ((job.status === 'queued' || job.status === 'running') && Date.now() < deadline) {
+                await new Promise(resolve => setTimeout(resolve, IMPORT_POLL_INTERVAL));
+                job = (await api.get(`/import/jobs/${res.data.job_id}`)).data;
+            }
+            if (job.status === 'queued' || job.status === 'running') {
+                showToast(t('import_still_running', 'The import is still running; reload later to see its results'), 'info');
+            } else if (job.status === 'failed') {
+                showToast(job.message || t('import_failed'), 'error');
+            } else {
+                const errorInfo = job.error_count ? `, ${t('import_errors', 'Errors')}: ${job.error_count}` : '';
+                showToast(`${t('import_success')} — ${t('import_created')}: ${job.created}, ${t('import_updated')}: ${job.updated}${errorInfo}`, job.error_count ? 'info' : 'success');
+            }
+            fetchSubnets();
             if (selectedSubnet) fetchIps(selectedSubnet.id);
         } catch (error) {
             console.error('Import failed', error);
@@ -277,8 +405,9 @@ const Dashboard = () => {
 
     // ── Subnet tree item ────────────────────────────────────────────────────────
     const renderSubnetTree = (subnet, level = 0) => {
-        const hasChildren = subnet.children && subnet.children.length > 0;
-        const isCollapsed = collapsedSubnets.has(subnet.id);
+        const children = childrenOf(subnet);
+        const hasChildren = subnet.child_count > 0;
+        const isCollapsed = !children || collapsedSubnets.has(subnet.id);
         const isSelected = selectedSubnet?.id === subnet.id;
 
         return (
@@ -293,7 +422,7 @@ const Dashboard = () => {
                 >
                     <span
                         className={`flex-shrink-0 transition-colors ${isSelected ? 'text-blue-200' : 'text-slate-600 group-hover:text-slate-400'}`}
-                        onClick={(e) => hasChildren && toggleCollapse(e, subnet.id)}
+                        onClick={(e) => hasChildren && toggleCollapse(e, subnet)}
                     >
                         {hasChildren
                             ? (isCollapsed ? <ChevronRight size={13} /> : <ChevronDown size={13} />)
@@ -329,7 +458,7 @@ const Dashboard = () => {
                         ><Trash2 size={11} /></button>
                     </div>
                 </li>
-                {hasChildren && !isCollapsed && subnet.children.map(child => renderSubnetTree(child, level + 1))}
+                {hasChildren && !isCollapsed && children.map(child => renderSubnetTree(child, level + 1))}
             </React.Fragment>
         );
     };
@@ -396,7 +525,7 @@ const Dashboard = () => {
                 </div>
 
                 <div className="flex-1 overflow-y-auto overflow-x-hidden px-2 pb-2">
-                    <ul>{organizeSubnets.map(s => renderSubnetTree(s))}</ul>
+                    <ul>{subnetTree.map(s => renderSubnetTree(s))}</ul>
                 </div>
 
                 {/* User bar */}
@@ -451,7 +580,7 @@ const Dashboard = () => {
                                         <span className="text-xs text-slate-400 dark:text-slate-500 truncate max-w-xs">{selectedSubnet.description}</span>
                                     )}
                                     <span className="text-xs text-slate-400 dark:text-slate-500">
-                                        {filteredIps.length} IP{filteredIps.length !== 1 ? 's' : ''}
+                                        {visibleTotal} IP{visibleTotal !== 1 ? 's' : ''}
                                     </span>
                                 </div>
                             </div>
@@ -491,7 +620,7 @@ const Dashboard = () => {
                                     </tr>
                                 </thead>
                                 <tbody className="divide-y divide-slate-100 dark:divide-slate-800">
-                                    {filteredIps.map(ip => (
+                                    {visibleIps.map(ip => (
                                         <tr key={ip.id} className="bg-white dark:bg-slate-900 hover:bg-slate-50 dark:hover:bg-slate-800/60 transition-colors">
                                             <td className="px-5 py-3 font-mono text-sm font-semibold text-slate-900 dark:text-white whitespace-nowrap">
                                                 {ip.ip_address}
@@ -527,7 +656,7 @@ const Dashboard = () => {
                                             </td>
                                         </tr>
                                     ))}
-                                    {filteredIps.length === 0 && (
+                                    {visibleIps.length === 0 && (
                                         <tr>
                                             <td colSpan="6" className="px-5 py-20 text-center bg-white dark:bg-slate-900">
                                                 <div className="flex flex-col items-center gap-3 text-slate-300 dark:text-slate-700">
@@ -541,6 +670,18 @@ const Dashboard = () => {
                                     )}
                                 </tbody>
                             </table>
+                            {visibleCursor && (
+                                <div className="flex items-center justify-center gap-3 py-4">
+                                    <span className="text-xs text-slate-400 dark:text-slate-500">
+                                        {t('showing_count', { shown: visibleIps.length, total: visibleTotal, defaultValue: '{{shown}} of {{total}}' })}
+                                    </span>
+                                    <button
+                                        onClick={loadMoreIps}
+                                        disabled={ipsLoadingMore}
+                                        className="text-xs font-medium px-3 py-1.5 rounded-lg border border-slate-300 dark:border-slate-600 text-slate-600 dark:text-slate-300 hover:bg-slate-100 dark:hover:bg-slate-800 disabled:opacity-50 transition-colors"
+                                    >{ipsLoadingMore ? '…' : t('load_more', 'Load more')}</button>
+                                </div>
+                            )}
                         </div>
                     </>
                 ) : (
@@ -576,18 +717,16 @@ const Dashboard = () => {
                                     required
                                 />
                             </div>
-                            {!editingSubnet && (
-                                <div>
-                                    <label className={MODAL_LABEL}>CIDR</label>
-                                    <input
-                                        className={`${MODAL_INPUT} font-mono`}
-                                        placeholder={t('cidr_placeholder')}
-                                        value={newSubnet.cidr}
-                                        onChange={e => setNewSubnet({ ...newSubnet, cidr: e.target.value })}
-                                        required
-                                    />
-                                </div>
-                            )}
+                            <div>
+                                <label className={MODAL_LABEL}>CIDR</label>
+                                <input
+                                    className={`${MODAL_INPUT} font-mono`}
+                                    placeholder={t('cidr_placeholder')}
+                                    value={editingSubnet ? editingSubnet.cidr : newSubnet.cidr}
+                                    onChange={e => editingSubnet ? setEditingSubnet({ ...editingSubnet, cidr: e.target.value }) : setNewSubnet({ ...newSubnet, cidr: e.target.value })}
+                                    required
+                                />
+                            </div>
                             <div>
                                 <label className={MODAL_LABEL}>{t('description_placeholder')}</label>
                                 <input
@@ -599,7 +738,7 @@ const Dashboard = () => {
                             </div>
                             {newSubnet.parent_id && !editingSubnet && (
                                 <p className="text-xs text-slate-500 dark:text-slate-400 bg-slate-50 dark:bg-slate-700/50 px-3 py-2 rounded-lg">
-                                    {t('child_subnet_of', { name: subnets.find(s => s.id === newSubnet.parent_id)?.name })}
+                                    {t('child_subnet_of', { name: subnetById.get(newSubnet.parent_id)?.name })}
                                 </p>
                             )}
                             <div className="flex justify-end gap-2 pt-2 border-t border-slate-100 dark:border-slate-700">
@@ -696,6 +835,26 @@ const Dashboard = () => {
                                     ? t('delete_ip_confirm', { name: deleteConfirm.name })
                                     : t('delete_subnet_confirm', { name: deleteConfirm.name })}
                             </p>
+                            {deleteConfirm.type === 'subnet' && (
+                                <label className="flex items-center gap-2 mt-3 text-sm text-slate-600 dark:text-slate-300">
+                                    <input
+                                        type="checkbox"
+                                        checked={deleteConfirm.recursive}
+                                        onChange={e => setDeleteConfirm({ ...deleteConfirm, recursive: e.target.checked })}
+                                    />
+                                    {t('delete_subnet_recursive')}
+                                </label>
+                            )}
+                            {deleteConfirm.type === 'subnet' && subnetById.get(deleteConfirm.id)?.parent_id && (
+                                <label className="flex items-center gap-2 mt-2 text-sm text-slate-600 dark:text-slate-300">
+                                    <input
+                                        type="checkbox"
+                                        checked={deleteConfirm.rehome}
+                                        onChange={e => setDeleteConfirm({ ...deleteConfirm, rehome: e.target.checked })}
+                                    />
+                                    {t('delete_subnet_rehome')}
+                                </label>
+                            )}
                         </div>
                         <div className="flex justify-end gap-2 px-6 pb-5">
                             <button onClick={cancelDelete} className="px-4 py-2 text-sm text-slate-600 dark:text-slate-300 hover:bg-slate-100 dark:hover:bg-slate-700 rounded-lg transition-colors">